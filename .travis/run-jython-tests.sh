@@ -1,6 +1,6 @@
 #!/bin/bash
 jython_path=~/Downloads/Jython/jython.jar;
-modules="requests settings uploadhandlers";
+modules="requests settings uploadhandlers multipart";
 for module in $modules; do
  java -jar "$jython_path" -m request_parser.tests."$module"."$module"
 done
\ No newline at end of file
@@ -1,3 +1,4 @@
+from copy import copy
 from os.path import normpath, isdir, join, isabs
 from os import errno, mkdir, remove
 from request_parser.files.utils import get_abs_path
@@ -24,6 +25,23 @@ class Settings:
         DATA_UPLOAD_MAX_MEMORY = "DATA_UPLOAD_MAX_MEMORY"
         DATA_UPLOAD_MAX_FIELDS = "DATA_UPLOAD_MAX_FIELDS"
         DEFAULT_CHARSET = "DEFAULT_CHARSET"
+        CONTENT_LENGTH_LIMITS = "CONTENT_LENGTH_LIMITS"
+        MULTIPART_ENGINE = "MULTIPART_ENGINE"
+        MAX_PART_HEADER_SIZE = "MAX_PART_HEADER_SIZE"
+        TRUST_PART_CONTENT_LENGTH = "TRUST_PART_CONTENT_LENGTH"
+        MULTIPART_BUFFER_MAX_SIZE = "MULTIPART_BUFFER_MAX_SIZE"
+        FILE_UPLOAD_MEMORY_BUDGET = "FILE_UPLOAD_MEMORY_BUDGET"
+        FILE_UPLOAD_DESTINATION_DIR = "FILE_UPLOAD_DESTINATION_DIR"
+        FILE_UPLOAD_DESTINATION_NAME = "FILE_UPLOAD_DESTINATION_NAME"
+        FILE_UPLOAD_TEMP_FILE_POOL_SIZE = "FILE_UPLOAD_TEMP_FILE_POOL_SIZE"
+        FILE_UPLOAD_WRITE_BUFFER_SIZE = "FILE_UPLOAD_WRITE_BUFFER_SIZE"
+        FILE_UPLOAD_WRITER_THREADS = "FILE_UPLOAD_WRITER_THREADS"
+        FILE_UPLOAD_WRITER_QUEUE_SIZE = "FILE_UPLOAD_WRITER_QUEUE_SIZE"
+        FILE_UPLOAD_COMPRESSION = "FILE_UPLOAD_COMPRESSION"
+        FILE_UPLOAD_MAX_SIZE = "FILE_UPLOAD_MAX_SIZE"
+        FILE_UPLOAD_ALLOWED_CONTENT_TYPES = "FILE_UPLOAD_ALLOWED_CONTENT_TYPES"
+        FILE_UPLOAD_ALLOWED_EXTENSIONS = "FILE_UPLOAD_ALLOWED_EXTENSIONS"
+        FILE_UPLOAD_POLICY_ACTION = "FILE_UPLOAD_POLICY_ACTION"
 
     #holds the different upload handlers
     #the ones listed below are the default ones which Django/request-parser
@@ -81,9 +99,167 @@ class Settings:
             self.DEFAULT_CHARSET = settings_dict[Settings.Key.DEFAULT_CHARSET]
         else:
             self.DEFAULT_CHARSET = default_settings.DEFAULT_CHARSET
+
+        #CONTENT_LENGTH_LIMITS
+        if Settings.Key.CONTENT_LENGTH_LIMITS in settings_dict:
+            self.CONTENT_LENGTH_LIMITS = settings_dict[Settings.Key.CONTENT_LENGTH_LIMITS]
+        else:
+            self.CONTENT_LENGTH_LIMITS = default_settings.CONTENT_LENGTH_LIMITS
+
+        #MULTIPART_ENGINE
+        if Settings.Key.MULTIPART_ENGINE in settings_dict:
+            self.MULTIPART_ENGINE = settings_dict[Settings.Key.MULTIPART_ENGINE]
+        else:
+            self.MULTIPART_ENGINE = default_settings.MULTIPART_ENGINE
+
+        #MAX_PART_HEADER_SIZE
+        if Settings.Key.MAX_PART_HEADER_SIZE in settings_dict:
+            self.MAX_PART_HEADER_SIZE = settings_dict[Settings.Key.MAX_PART_HEADER_SIZE]
+        else:
+            self.MAX_PART_HEADER_SIZE = default_settings.MAX_PART_HEADER_SIZE
+
+        #TRUST_PART_CONTENT_LENGTH
+        if Settings.Key.TRUST_PART_CONTENT_LENGTH in settings_dict:
+            self.TRUST_PART_CONTENT_LENGTH = settings_dict[Settings.Key.TRUST_PART_CONTENT_LENGTH]
+        else:
+            self.TRUST_PART_CONTENT_LENGTH = default_settings.TRUST_PART_CONTENT_LENGTH
+
+        #MULTIPART_BUFFER_MAX_SIZE
+        if Settings.Key.MULTIPART_BUFFER_MAX_SIZE in settings_dict:
+            self.MULTIPART_BUFFER_MAX_SIZE = settings_dict[Settings.Key.MULTIPART_BUFFER_MAX_SIZE]
+        else:
+            self.MULTIPART_BUFFER_MAX_SIZE = default_settings.MULTIPART_BUFFER_MAX_SIZE
+
+        #FILE_UPLOAD_MEMORY_BUDGET
+        if Settings.Key.FILE_UPLOAD_MEMORY_BUDGET in settings_dict:
+            self.FILE_UPLOAD_MEMORY_BUDGET = settings_dict[Settings.Key.FILE_UPLOAD_MEMORY_BUDGET]
+        else:
+            self.FILE_UPLOAD_MEMORY_BUDGET = default_settings.FILE_UPLOAD_MEMORY_BUDGET
+
+        #FILE_UPLOAD_DESTINATION_DIR
+        if Settings.Key.FILE_UPLOAD_DESTINATION_DIR in settings_dict:
+            self.FILE_UPLOAD_DESTINATION_DIR = settings_dict[Settings.Key.FILE_UPLOAD_DESTINATION_DIR]
+        else:
+            self.FILE_UPLOAD_DESTINATION_DIR = default_settings.FILE_UPLOAD_DESTINATION_DIR
+
+        #FILE_UPLOAD_DESTINATION_NAME
+        if Settings.Key.FILE_UPLOAD_DESTINATION_NAME in settings_dict:
+            self.FILE_UPLOAD_DESTINATION_NAME = settings_dict[Settings.Key.FILE_UPLOAD_DESTINATION_NAME]
+        else:
+            self.FILE_UPLOAD_DESTINATION_NAME = default_settings.FILE_UPLOAD_DESTINATION_NAME
+
+        #FILE_UPLOAD_TEMP_FILE_POOL_SIZE
+        if Settings.Key.FILE_UPLOAD_TEMP_FILE_POOL_SIZE in settings_dict:
+            self.FILE_UPLOAD_TEMP_FILE_POOL_SIZE = settings_dict[Settings.Key.FILE_UPLOAD_TEMP_FILE_POOL_SIZE]
+        else:
+            self.FILE_UPLOAD_TEMP_FILE_POOL_SIZE = default_settings.FILE_UPLOAD_TEMP_FILE_POOL_SIZE
+
+        #FILE_UPLOAD_WRITE_BUFFER_SIZE
+        if Settings.Key.FILE_UPLOAD_WRITE_BUFFER_SIZE in settings_dict:
+            self.FILE_UPLOAD_WRITE_BUFFER_SIZE = settings_dict[Settings.Key.FILE_UPLOAD_WRITE_BUFFER_SIZE]
+        else:
+            self.FILE_UPLOAD_WRITE_BUFFER_SIZE = default_settings.FILE_UPLOAD_WRITE_BUFFER_SIZE
+
+        #FILE_UPLOAD_WRITER_THREADS
+        if Settings.Key.FILE_UPLOAD_WRITER_THREADS in settings_dict:
+            self.FILE_UPLOAD_WRITER_THREADS = settings_dict[Settings.Key.FILE_UPLOAD_WRITER_THREADS]
+        else:
+            self.FILE_UPLOAD_WRITER_THREADS = default_settings.FILE_UPLOAD_WRITER_THREADS
+
+        #FILE_UPLOAD_WRITER_QUEUE_SIZE
+        if Settings.Key.FILE_UPLOAD_WRITER_QUEUE_SIZE in settings_dict:
+            self.FILE_UPLOAD_WRITER_QUEUE_SIZE = settings_dict[Settings.Key.FILE_UPLOAD_WRITER_QUEUE_SIZE]
+        else:
+            self.FILE_UPLOAD_WRITER_QUEUE_SIZE = default_settings.FILE_UPLOAD_WRITER_QUEUE_SIZE
+
+        #FILE_UPLOAD_COMPRESSION
+        if Settings.Key.FILE_UPLOAD_COMPRESSION in settings_dict:
+            self.FILE_UPLOAD_COMPRESSION = settings_dict[Settings.Key.FILE_UPLOAD_COMPRESSION]
+        else:
+            self.FILE_UPLOAD_COMPRESSION = default_settings.FILE_UPLOAD_COMPRESSION
+
+        #FILE_UPLOAD_MAX_SIZE
+        if Settings.Key.FILE_UPLOAD_MAX_SIZE in settings_dict:
+            self.FILE_UPLOAD_MAX_SIZE = settings_dict[Settings.Key.FILE_UPLOAD_MAX_SIZE]
+        else:
+            self.FILE_UPLOAD_MAX_SIZE = default_settings.FILE_UPLOAD_MAX_SIZE
+
+        #FILE_UPLOAD_ALLOWED_CONTENT_TYPES
+        if Settings.Key.FILE_UPLOAD_ALLOWED_CONTENT_TYPES in settings_dict:
+            self.FILE_UPLOAD_ALLOWED_CONTENT_TYPES = settings_dict[Settings.Key.FILE_UPLOAD_ALLOWED_CONTENT_TYPES]
+        else:
+            self.FILE_UPLOAD_ALLOWED_CONTENT_TYPES = default_settings.FILE_UPLOAD_ALLOWED_CONTENT_TYPES
+
+        #FILE_UPLOAD_ALLOWED_EXTENSIONS
+        if Settings.Key.FILE_UPLOAD_ALLOWED_EXTENSIONS in settings_dict:
+            self.FILE_UPLOAD_ALLOWED_EXTENSIONS = settings_dict[Settings.Key.FILE_UPLOAD_ALLOWED_EXTENSIONS]
+        else:
+            self.FILE_UPLOAD_ALLOWED_EXTENSIONS = default_settings.FILE_UPLOAD_ALLOWED_EXTENSIONS
+
+        #FILE_UPLOAD_POLICY_ACTION
+        if Settings.Key.FILE_UPLOAD_POLICY_ACTION in settings_dict:
+            self.FILE_UPLOAD_POLICY_ACTION = settings_dict[Settings.Key.FILE_UPLOAD_POLICY_ACTION]
+        else:
+            self.FILE_UPLOAD_POLICY_ACTION = default_settings.FILE_UPLOAD_POLICY_ACTION
     
+    #an overlay reads the settings it doesn't set from _base
+    _base = None
+    #the shared default settings can't be changed
+    _frozen = False
+
+    #default settings, computed once per process for each check_presence
+    _defaults = {}
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError("Settings are frozen, use overlay() to change %s" % name)
+        self.__dict__[name] = value
+
+    def __delattr__(self, name):
+        if self._frozen:
+            raise AttributeError("Settings are frozen, use overlay() to change %s" % name)
+        del self.__dict__[name]
+
+    def __getattr__(self, name):
+        #only called for the settings not set on this object
+        if self._base is None or name.startswith('__'):
+            raise AttributeError(name)
+        value = getattr(self._base, name)
+        #a dict or a list would be changed in place for the settings below
+        #too, this overlay gets its own copy
+        if isinstance(value, (dict, list)):
+            value = copy(value)
+            self.__dict__[name] = value
+        return value
+
+    def overlay(self, **settings):
+        """
+        Return Settings which read through to these ones except for the given
+        settings (by attribute name, e.g. DEFAULT_CHARSET='utf-8'). Changing
+        the overlay leaves these settings untouched.
+        """
+        overlay = Settings()
+        overlay._base = self
+        for name, value in settings.items():
+            setattr(overlay, name, value)
+        return overlay
+
     @classmethod
     def default(cls, check_presence=False):
+        """
+        Return the default settings.
+
+        They're computed, and the upload directory checked, once per process
+        and shared frozen; each call returns a new overlay of them, which can
+        be changed without affecting the other callers.
+        """
+        settings = Settings._defaults.get(check_presence)
+        if settings is None:
+            settings = Settings._defaults[check_presence] = Settings._create_default(check_presence)
+        return settings.overlay()
+
+    @staticmethod
+    def _create_default(check_presence):
         settings = Settings()
 
         #Directory where file upload files will be stored
@@ -109,9 +285,94 @@ class Settings:
 
         #Default charset per HTTP 1.1 - https://www.w3.org/Protocols/rfc2616/rfc2616-sec3.html#sec3.7.1
         settings.DEFAULT_CHARSET = 'ISO-8859-1'
+
+        # Maximum declared Content-Length, in bytes, of a request body per
+        # Content-Type; the '*' key applies to any other Content-Type.
+        # Requests declaring a larger body are rejected (RequestDataTooBig)
+        # before any of the body is read.
+        settings.CONTENT_LENGTH_LIMITS = {}
+
+        # Multipart parsing engine: 'stream' parses each part through its own
+        # boundary sensitive stream, 'flat' walks the whole body with a single
+        # state machine which is much cheaper per part (forms with many fields).
+        settings.MULTIPART_ENGINE = 'stream'
+
+        # Maximum size in bytes of the headers of a single multipart part.
+        # A part whose headers don't end within this many bytes is treated
+        # as raw data and ignored.
+        settings.MAX_PART_HEADER_SIZE = 8192
+
+        # Whether the Content-Length header of a multipart part is trusted: its
+        # body is then read as that many bytes without searching the boundary
+        # in it (only honored by the 'flat' MULTIPART_ENGINE). Only enable this
+        # for clients known to send correct part lengths.
+        settings.TRUST_PART_CONTENT_LENGTH = False
+
+        # Maximum size in bytes of a multipart body that is read in memory at
+        # once and split there instead of being parsed by the MULTIPART_ENGINE
+        # chunk by chunk. None always uses the MULTIPART_ENGINE.
+        settings.MULTIPART_BUFFER_MAX_SIZE = 64 * 2 ** 10
+
+        # Maximum size in bytes of the uploaded files held in memory by all the
+        # requests of the process together. Uploads that don't fit are streamed
+        # to the file system instead. None means no process-wide limit, only
+        # FILE_UPLOAD_MAX_MEMORY_SIZE per request.
+        settings.FILE_UPLOAD_MEMORY_BUDGET = None
+
+        # Directory DestinationFileUploadHandler writes uploaded files to, in
+        # place (they aren't copied from FILE_UPLOAD_TEMP_DIR afterwards).
+        # None disables the handler.
+        settings.FILE_UPLOAD_DESTINATION_DIR = None
+
+        # Callable returning the name of an uploaded file in
+        # FILE_UPLOAD_DESTINATION_DIR, called with the field name, the file name
+        # sent by the client and the content type. None names files with a
+        # random hex string and the extension of the client's file name.
+        settings.FILE_UPLOAD_DESTINATION_NAME = None
+
+        # Number of temp files kept created in FILE_UPLOAD_TEMP_DIR by a
+        # background thread for the uploads streamed to disk, each holding a
+        # file descriptor. 0 creates them on demand.
+        settings.FILE_UPLOAD_TEMP_FILE_POOL_SIZE = 0
+
+        # Number of bytes of an upload streamed to disk gathered before they are
+        # written in a single write. 0 writes each chunk as it's received.
+        settings.FILE_UPLOAD_WRITE_BUFFER_SIZE = 256 * 2 ** 10
+
+        # Number of background threads writing uploads streamed to disk so that
+        # parsing overlaps with disk writes. 0 writes on the request's thread.
+        settings.FILE_UPLOAD_WRITER_THREADS = 0
+
+        # Number of writes (of up to FILE_UPLOAD_WRITE_BUFFER_SIZE bytes) each
+        # writer thread queues before the request's thread waits for it.
+        settings.FILE_UPLOAD_WRITER_QUEUE_SIZE = 8
+
+        # Compression codec ('gzip', 'zlib', 'bz2' or, on Python 3, 'lzma') of
+        # the files stored by CompressingFileUploadHandler per Content-Type; a
+        # 'major/*' key applies to the types of that major type and the '*' key
+        # to any other type. Content types without a codec are stored as is.
+        settings.FILE_UPLOAD_COMPRESSION = {
+            'text/*' : 'gzip',
+            'application/json' : 'gzip',
+            'application/xml' : 'gzip',
+        }
+
+        # Upload policy enforced by PolicyFileUploadHandler while a file is
+        # received. Maximum size in bytes of a file, None for no limit.
+        settings.FILE_UPLOAD_MAX_SIZE = None
+
+        # Content types ('major/*' ones included) and file name extensions of
+        # the files accepted by PolicyFileUploadHandler, None accepts any.
+        settings.FILE_UPLOAD_ALLOWED_CONTENT_TYPES = None
+        settings.FILE_UPLOAD_ALLOWED_EXTENSIONS = None
+
+        # What PolicyFileUploadHandler does with a file breaking the policy:
+        # 'skip' it (SkipFile) or 'stop' the whole upload (StopUpload).
+        settings.FILE_UPLOAD_POLICY_ACTION = 'skip'
         
         settings.FILE_UPLOAD_TEMP_DIR = settings._check_upload_dir(check_presence=check_presence)
 
+        settings._frozen = True
         return settings
 
     def _check_upload_dir(self, check_presence=False):
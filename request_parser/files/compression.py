@@ -0,0 +1,79 @@
+"""
+Incremental compression codecs of the compressed file uploads.
+
+Each codec makes compressor objects (compress(data)/flush()) and decompressor
+objects (decompress(data)/flush()). 'lzma' is only there when the lzma module
+can be imported (Python 3).
+"""
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+__all__ = ('CODECS', 'get_codec', 'compression_codec')
+
+class Codec(object):
+    def __init__(self, name, compressor, decompressor):
+        self.name = name
+        self._compressor = compressor
+        self._decompressor = decompressor
+
+    def compressor(self):
+        return self._compressor()
+
+    def decompressor(self):
+        return _Decompressor(self._decompressor())
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.name)
+
+class _Decompressor(object):
+    """
+    Same interface for all the decompressors: flush() is only offered by zlib's.
+    """
+    def __init__(self, decompressor):
+        self._decompressor = decompressor
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        flush = getattr(self._decompressor, 'flush', None)
+        return flush() if flush is not None else b''
+
+#wbits of the zlib and gzip (header and trailer) formats
+ZLIB_WBITS = zlib.MAX_WBITS
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+CODECS = {
+    'zlib' : Codec('zlib', lambda: zlib.compressobj(6, zlib.DEFLATED, ZLIB_WBITS),
+                   lambda: zlib.decompressobj(ZLIB_WBITS)),
+    'gzip' : Codec('gzip', lambda: zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS),
+                   lambda: zlib.decompressobj(GZIP_WBITS)),
+    'bz2' : Codec('bz2', lambda: bz2.BZ2Compressor(9), bz2.BZ2Decompressor),
+}
+if lzma is not None:
+    CODECS['lzma'] = Codec('lzma', lzma.LZMACompressor, lzma.LZMADecompressor)
+
+def get_codec(name):
+    """
+    Return the codec called name, None for None or a codec that isn't
+    available.
+    """
+    return CODECS.get(name)
+
+def compression_codec(content_type, compression):
+    """
+    Return the codec the mapping compression gives to content_type: by exact
+    type, then by 'major/*' and then by '*'. None stores the content as is.
+    """
+    content_type = (content_type or '').lower()
+    if content_type in compression:
+        return get_codec(compression[content_type])
+    major_type = content_type.split('/', 1)[0] + '/*'
+    if major_type in compression:
+        return get_codec(compression[major_type])
+    return get_codec(compression.get('*'))
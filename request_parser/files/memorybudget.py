@@ -0,0 +1,112 @@
+"""
+Process-wide budget for the memory upload handlers buffer uploads in.
+
+``FILE_UPLOAD_MAX_MEMORY_SIZE`` bounds a single request; a ``MemoryBudget``
+bounds what all the requests being parsed concurrently hold in memory.
+Handlers reserve from it as they buffer and spill to disk when it's exhausted.
+"""
+import threading
+
+__all__ = ('MemoryBudget', 'MemoryReservation', 'get_memory_budget')
+
+class MemoryBudget(object):
+    """
+    A thread-safe count of bytes that can be held in memory (a byte
+    semaphore that never blocks).
+    """
+    def __init__(self, size):
+        self.size = size
+        self._current = 0
+        self._peak = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        """
+        Bytes currently reserved.
+        """
+        return self._current
+
+    @property
+    def peak(self):
+        """
+        Highest number of bytes reserved at once.
+        """
+        return self._peak
+
+    @property
+    def available(self):
+        return self.size - self._current
+
+    def reserve(self, size):
+        """
+        Reserve size bytes, return False if the budget can't hold them.
+        """
+        with self._lock:
+            if self._current + size > self.size:
+                return False
+            self._current += size
+            if self._current > self._peak:
+                self._peak = self._current
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self._current = max(0, self._current - size)
+
+    def reset_peak(self):
+        with self._lock:
+            self._peak = self._current
+
+    def __repr__(self):
+        return "<%s: %d/%d (peak %d)>" % (self.__class__.__name__, self._current, self.size, self._peak)
+
+class MemoryReservation(object):
+    """
+    Bytes reserved from a MemoryBudget for one upload, given back all at
+    once by release().
+    """
+    def __init__(self, budget, size=0):
+        self.budget = budget
+        self.size = size
+
+    def reserve(self, size):
+        if not self.budget.reserve(size):
+            return False
+        self.size += size
+        return True
+
+    def split(self, size):
+        """
+        Move up to size bytes of this reservation to a new one.
+        """
+        size = min(size, self.size)
+        self.size -= size
+        return MemoryReservation(self.budget, size)
+
+    def release(self):
+        if self.size:
+            self.budget.release(self.size)
+            self.size = 0
+
+    def __del__(self):
+        #a file dropped without being closed gives its memory back too
+        self.release()
+
+#budgets shared by the whole process, by size
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+def get_memory_budget(settings):
+    """
+    Return the process-wide MemoryBudget of settings.FILE_UPLOAD_MEMORY_BUDGET
+    bytes, None when no budget is set.
+    """
+    size = settings.FILE_UPLOAD_MEMORY_BUDGET
+    if size is None:
+        return None
+    with _budgets_lock:
+        budget = _budgets.get(size)
+        if budget is None:
+            budget = _budgets[size] = MemoryBudget(size)
+        return budget
@@ -0,0 +1,105 @@
+"""
+Move a file in the safest way possible::
+
+    >>> from request_parser.files.move import file_move_safe
+    >>> file_move_safe("/tmp/old_file", "/tmp/new_file")
+"""
+
+import errno
+import os
+from shutil import copystat
+
+__all__ = ('file_move_safe', 'link_or_rename')
+
+def _samefile(src, dst):
+    # Macintosh, Unix.
+    if hasattr(os.path, 'samefile'):
+        try:
+            return os.path.samefile(src, dst)
+        except OSError:
+            return False
+
+    # All other platforms: check for same pathname.
+    return (os.path.normcase(os.path.abspath(src)) ==
+            os.path.normcase(os.path.abspath(dst)))
+
+def _copy_fd(src_fd, dst_fd, chunk_size):
+    """
+    Copy the content of src_fd to dst_fd through chunk_size reads and writes,
+    the fallback of a move a rename can't do.
+    """
+    while True:
+        data = os.read(src_fd, chunk_size)
+        if not data:
+            break
+        os.write(dst_fd, data)
+
+def file_move_safe(old_file_name, new_file_name, chunk_size=1024 * 64, allow_overwrite=False):
+    """
+    Move a file from one location to another in the safest way possible.
+
+    First, try ``os.rename``, which is simple but will break across filesystems.
+    If that fails, copy the file to its new location and remove the old one.
+    """
+    # There's no reason to move if we don't have to.
+    if _samefile(old_file_name, new_file_name):
+        return
+
+    if not allow_overwrite and os.access(new_file_name, os.F_OK):
+        raise IOError("Destination file %s exists and allow_overwrite is False" % new_file_name)
+
+    try:
+        os.rename(old_file_name, new_file_name)
+        return
+    except OSError:
+        # OSError happens with os.rename() if moving to another filesystem or
+        # when moving opened files on certain operating systems.
+        pass
+
+    # first open the old file, so that it won't go away
+    with open(old_file_name, 'rb') as old_file:
+        # now open the new file, not forgetting allow_overwrite
+        fd = os.open(new_file_name, (os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0) |
+                                     (os.O_EXCL if not allow_overwrite else os.O_TRUNC)))
+        try:
+            _copy_fd(old_file.fileno(), fd, chunk_size)
+        finally:
+            os.close(fd)
+
+    try:
+        copystat(old_file_name, new_file_name)
+    except OSError:
+        # Certain filesystems (e.g. CIFS) fail to copy the file's metadata if
+        # the type of the destination filesystem isn't the same as the source
+        # filesystem; ignore that.
+        pass
+
+    try:
+        os.remove(old_file_name)
+    except OSError as e:
+        # Certain operating systems (Cygwin and Windows)
+        # fail when deleting opened files, ignore it.  (For the
+        # systems where this happens, temporary files will be auto-deleted
+        # on close anyway.)
+        if getattr(e, 'winerror', 0) != 32:
+            raise
+
+def link_or_rename(old_file_name, new_file_name):
+    """
+    Atomically give old_file_name the name new_file_name.
+
+    A hard link is tried first so that an existing new_file_name is never
+    replaced (OSError with errno EEXIST), falling back to ``os.rename`` where
+    the file system can't link.
+    """
+    link = getattr(os, 'link', None)
+    if link is not None:
+        try:
+            link(old_file_name, new_file_name)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                raise
+        else:
+            os.remove(old_file_name)
+            return
+    os.rename(old_file_name, new_file_name)
@@ -14,14 +14,23 @@ arguments available in tempfile.NamedTemporaryFile.
 
 1: https://mail.python.org/pipermail/python-list/2005-December/336957.html
 2: https://bugs.python.org/issue14243
+
+It also provides upload_temporary_file(), the temp file factory of the upload
+path, which can take the files from a pool filled in the background.
 """
 
+import atexit
 import os
 import tempfile
+import threading
+
+from six.moves import queue
 
+from request_parser.files.move import link_or_rename
 from request_parser.files.utils import FileProxyMixin
 
-__all__ = ('NamedTemporaryFile', 'gettempdir',)
+__all__ = ('NamedTemporaryFile', 'gettempdir', 'PooledTemporaryFile', 'TemporaryFilePool',
+           'upload_temporary_file',)
 
 
 if os.name == 'nt':
@@ -72,3 +81,149 @@ else:
     NamedTemporaryFile = tempfile.NamedTemporaryFile
 
 gettempdir = tempfile.gettempdir
+
+
+class PooledTemporaryFile(FileProxyMixin, object):
+    """
+    Temporary file created ahead of time by a TemporaryFilePool, removed on
+    close like a NamedTemporaryFile.
+
+    The suffix of the upload is only known when the file is taken from the
+    pool: the file is renamed to take it the first time its name is asked
+    for, most uploads never are.
+    """
+    mode = 'w+b'
+
+    def __init__(self, dir):
+        fd, self._path = tempfile.mkstemp(dir=dir)
+        self.file = os.fdopen(fd, self.mode)
+        self.suffix = ''
+        self._named = False
+        self.close_called = False
+
+    @property
+    def name(self):
+        if not self._named:
+            self._named = True
+            if self.suffix:
+                try:
+                    link_or_rename(self._path, self._path + self.suffix)
+                except OSError:
+                    #the file keeps its name without the suffix
+                    pass
+                else:
+                    self._path += self.suffix
+        return self._path
+
+    # Because close can be called during shutdown
+    # we need to cache os.unlink and access it
+    # as self.unlink only
+    unlink = os.unlink
+
+    def close(self):
+        if not self.close_called:
+            self.close_called = True
+            try:
+                self.file.close()
+            except (OSError, IOError):
+                pass
+            try:
+                self.unlink(self._path)
+            except OSError:
+                pass
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        self.file.__enter__()
+        return self
+
+    def __exit__(self, exc, value, tb):
+        self.close()
+
+class TemporaryFilePool(object):
+    """
+    Temporary files created ahead of time in dir by a background thread, so
+    that taking one costs no file creation.
+
+    Each pooled file holds a file descriptor; the pooled files are removed
+    when the process exits.
+    """
+    def __init__(self, dir, size):
+        self.dir = dir
+        self._files = queue.Queue(maxsize=size)
+        self._filler = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def get(self, suffix=''):
+        """
+        Return a pooled file, None if there's none ready.
+        """
+        self._start()
+        try:
+            temp_file = self._files.get_nowait()
+        except queue.Empty:
+            return None
+        temp_file.suffix = suffix
+        return temp_file
+
+    def close(self):
+        """
+        Stop filling the pool and remove the files in it.
+        """
+        self._closed = True
+        self._drain()
+        if self._filler is not None:
+            #the filler puts at most one more file before it sees the pool is
+            #closed, it mustn't outlive close() (at exit in particular)
+            self._filler.join()
+            self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                self._files.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _start(self):
+        with self._lock:
+            if self._filler is None:
+                self._filler = threading.Thread(target=self._fill, name='TemporaryFilePool')
+                self._filler.daemon = True
+                self._filler.start()
+                atexit.register(self.close)
+
+    def _fill(self):
+        while not self._closed:
+            try:
+                temp_file = PooledTemporaryFile(self.dir)
+            except (IOError, OSError):
+                #the directory can't be written to (anymore), get() always
+                #misses and the uploads create their files themselves
+                return
+            #blocks while the pool is full
+            self._files.put(temp_file)
+
+#pools shared by the whole process, by directory and size
+_pools = {}
+_pools_lock = threading.Lock()
+
+def upload_temporary_file(suffix='', dir=None, pool_size=0):
+    """
+    Return a temp file to stream an upload into.
+
+    If pool_size isn't 0 it's taken from a TemporaryFilePool of pool_size
+    files in dir, a NamedTemporaryFile is created when the pool is empty.
+    """
+    if pool_size:
+        with _pools_lock:
+            pool = _pools.get((dir, pool_size))
+            if pool is None:
+                pool = _pools[(dir, pool_size)] = TemporaryFilePool(dir, pool_size)
+        temp_file = pool.get(suffix)
+        if temp_file is not None:
+            return temp_file
+    return NamedTemporaryFile(suffix=suffix, dir=dir)
@@ -4,12 +4,15 @@ Classes representing uploaded files.
 
 import os
 from io import BytesIO
+from tempfile import mkstemp
 
 from request_parser.conf.settings import Settings
 from request_parser.files import temp as tempfile
 from request_parser.files.base import File
+from request_parser.files.move import file_move_safe, link_or_rename
 
-__all__ = ('UploadedFile', 'TemporaryUploadedFile', 'InMemoryUploadedFile', 'SimpleUploadedFile')
+__all__ = ('UploadedFile', 'TemporaryUploadedFile', 'InMemoryUploadedFile', 'SimpleUploadedFile',
+           'DestinationUploadedFile', 'CompressedUploadedFile')
 
 class UploadedFile(File, object):
     """
@@ -50,6 +53,31 @@ class UploadedFile(File, object):
 
     name = property(_get_name, _set_name)
 
+    def move_to(self, path, allow_overwrite=False):
+        """
+        Store the content of the file at path and return path.
+
+        This writes a copy of the content; files already on disk move
+        themselves there instead.
+        """
+        fd = os.open(path, (os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0) |
+                            (os.O_EXCL if not allow_overwrite else os.O_TRUNC)))
+        with os.fdopen(fd, 'wb') as destination:
+            for chunk in self.chunks():
+                destination.write(chunk)
+        return path
+
+    def _move_file_to(self, current_path, path, allow_overwrite):
+        """
+        Move the file at current_path to path, renaming it when possible,
+        and reopen it there.
+        """
+        self.file.flush()
+        file_move_safe(current_path, path, allow_overwrite=allow_overwrite)
+        self.close()
+        self.file = open(path, 'rb')
+        return path
+
 class TemporaryUploadedFile(UploadedFile, object):
     """
     A file uploaded to a temporary location (i.e. stream-to-disk).
@@ -59,29 +87,191 @@ class TemporaryUploadedFile(UploadedFile, object):
         _settings = settings
         if _settings is None:
             _settings = Settings.default()
-        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=_settings.FILE_UPLOAD_TEMP_DIR)
+        file = tempfile.upload_temporary_file(suffix='.upload' + ext, dir=_settings.FILE_UPLOAD_TEMP_DIR,
+                                              pool_size=_settings.FILE_UPLOAD_TEMP_FILE_POOL_SIZE)
         super(TemporaryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra, transfer_encoding)
 
     def temporary_file_path(self):
         """Return the full path of this file."""
         return self.file.name
 
+    def move_to(self, path, allow_overwrite=False):
+        """
+        Move the file to path, by renaming it when it's on the same file
+        system, and return path.
+        """
+        return self._move_file_to(self.temporary_file_path(), path, allow_overwrite)
+
     def close(self):
         try:
             return self.file.close()
-        except IOError:
+        except (IOError, OSError):
             # The file was moved or deleted before the tempfile could unlink
             # it. Still sets self.file.close_called and calls
             # self.file.file.close() before the exception.     
             pass
 
+class CompressedUploadedFile(TemporaryUploadedFile, object):
+    """
+    A file uploaded to a temporary location compressed with codec (a
+    compression.Codec).
+
+    read() and chunks() return the original content; size is its size and
+    stored_size the size of the temporary file, which holds the compressed
+    content.
+    """
+    def __init__(self, name, content_type, size, charset, codec, settings=None, content_type_extra=None, transfer_encoding=None):
+        super(CompressedUploadedFile, self).__init__(name, content_type, size, charset, settings, content_type_extra, transfer_encoding)
+        self.codec = codec
+        self.stored_size = 0
+        self._reset_decompression()
+
+    def _reset_decompression(self):
+        self._decompressor = self.codec.decompressor()
+        #decompressed content not read yet
+        self._buffer = bytearray()
+        self._eof = False
+        #position in the original content
+        self._position = 0
+
+    def open(self, mode=None):
+        """
+        Rewind the file, reopening the compressed content if the file was
+        closed after being moved.
+        """
+        if not self.closed:
+            self.file.seek(0)
+        elif os.path.exists(self.file.name):
+            #the compressed content is bytes whatever mode is
+            self.file = open(self.file.name, 'rb')
+        else:
+            raise ValueError("The file cannot be reopened.")
+        self._reset_decompression()
+        return self
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Only rewinding is supported: seek(0).
+        """
+        if offset != 0 or whence != os.SEEK_SET:
+            raise IOError("A compressed upload can only be rewound.")
+        self.file.seek(0)
+        self._reset_decompression()
+
+    def tell(self):
+        """
+        Return the position in the original content.
+        """
+        return self._position
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes of the original content, all of it if size is
+        negative or None.
+        """
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            data = self.file.read(self.DEFAULT_CHUNK_SIZE)
+            if data:
+                self._buffer.extend(self._decompressor.decompress(data))
+            else:
+                self._buffer.extend(self._decompressor.flush())
+                self._eof = True
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._position += len(data)
+        return data
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        self.seek(0)
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def multiple_chunks(self, chunk_size=None):
+        return self.size > (chunk_size or self.DEFAULT_CHUNK_SIZE)
+
+    def move_to(self, path, allow_overwrite=False, compressed=False):
+        """
+        Store the original content at path and return path.
+
+        If compressed is true, the compressed content is moved there instead,
+        by renaming the temporary file when it's on the same file system.
+        """
+        if not compressed:
+            return UploadedFile.move_to(self, path, allow_overwrite)
+        super(CompressedUploadedFile, self).move_to(path, allow_overwrite)
+        self._reset_decompression()
+        return path
+
+class DestinationUploadedFile(UploadedFile, object):
+    """
+    A file uploaded straight into its destination directory.
+
+    The content is written to a hidden partial file next to destination_path
+    which finalize() moves to destination_path atomically. A file closed before
+    being finalized is removed.
+    """
+    def __init__(self, name, content_type, size, charset, destination_path, content_type_extra=None, transfer_encoding=None):
+        directory, base_name = os.path.split(destination_path)
+        fd, self._partial_path = mkstemp(prefix='.' + base_name + '.', suffix='.part', dir=directory)
+        file = os.fdopen(fd, 'w+b')
+        super(DestinationUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra, transfer_encoding)
+        self.destination_path = destination_path
+        self.finalized = False
+
+    def file_path(self):
+        """Return the full path the content is currently at."""
+        return self.destination_path if self.finalized else self._partial_path
+
+    def finalize(self):
+        """
+        Move the content to destination_path, never replacing an existing file
+        where the file system supports hard links.
+        """
+        self.file.flush()
+        link_or_rename(self._partial_path, self.destination_path)
+        self.finalized = True
+
+    def move_to(self, path, allow_overwrite=False):
+        """
+        Move the file to path, by renaming it when it's on the same file
+        system, and return path.
+        """
+        if not self.finalized:
+            self.finalize()
+        self.destination_path = self._move_file_to(self.destination_path, path, allow_overwrite)
+        return path
+
+    def close(self):
+        try:
+            self.file.close()
+        finally:
+            if not self.finalized:
+                try:
+                    os.remove(self._partial_path)
+                except OSError:
+                    pass
+
 class InMemoryUploadedFile(UploadedFile, object):
     """
     A file uploaded into memory (i.e. stream-to-memory).
     """
-    def __init__(self, file, field_name, name, content_type, size, charset, content_type_extra=None, transfer_encoding=None):
+    def __init__(self, file, field_name, name, content_type, size, charset, content_type_extra=None, transfer_encoding=None, memory_reservation=None):
         super(InMemoryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra, transfer_encoding)
         self.field_name = field_name
+        #MemoryReservation of the content, released when the file is closed
+        #(or garbage collected)
+        self.memory_reservation = memory_reservation
+
+    def close(self):
+        if self.memory_reservation is not None:
+            self.memory_reservation.release()
+        super(InMemoryUploadedFile, self).close()
 
     def open(self, mode=None):
         self.file.seek(0)
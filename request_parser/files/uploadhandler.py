@@ -2,16 +2,24 @@
 Base file upload handler classes, and the built-in concrete subclasses
 """
 
+import errno
+import os
+import threading
+import uuid
 from io import BytesIO
+
+from request_parser.files.compression import compression_codec
+from request_parser.files.memorybudget import MemoryReservation, get_memory_budget
+from request_parser.files.writerpool import get_writer_pool
 from request_parser.files.uploadedfile import (
-    InMemoryUploadedFile, TemporaryUploadedFile,
+    CompressedUploadedFile, DestinationUploadedFile, InMemoryUploadedFile, TemporaryUploadedFile,
 )
 from request_parser.utils.module_loading import import_string
 
 __all__ = [
     'UploadFileException', 'StopUpload', 'SkipFile', 'FileUploadHandler',
     'TemporaryFileUploadHandler', 'MemoryFileUploadHandler', 'load_handler',
-    'StopFutureHandlers'
+    'StopFutureHandlers', 'PolicyFileUploadHandler', 'UploadPolicyViolation'
 ]
 
 class UploadFileException(Exception):
@@ -57,6 +65,9 @@ class FileUploadHandler:
     """
     chunk_size = 64 * 2 ** 10  # : The default chunk size is 64 KB.
 
+    #whether an instance can be reset() and handed to another request
+    reusable = False
+
     def __init__(self, request=None):
         self.file_name = None
         self.content_type = None
@@ -66,6 +77,14 @@ class FileUploadHandler:
         self.transfer_encoding = None
         self.request = request
 
+    def reset(self, request=None):
+        """
+        Make a reusable handler ready for another request, as if it was just
+        created for it.
+        """
+        self.__dict__.pop('file', None)
+        FileUploadHandler.__init__(self, request)
+
     def handle_raw_input(self, input_data, META, content_length, boundary, settings, encoding=None):
         """
         Handle the raw input from the client.
@@ -115,6 +134,15 @@ class FileUploadHandler:
         """
         raise NotImplementedError('subclasses of FileUploadHandler must provide a file_complete() method')
 
+    def free_file(self):
+        """
+        Signal that the file being received won't be completed (it was skipped
+        or the upload stopped). Its file handle is freed.
+        """
+        file = getattr(self, 'file', None)
+        if file is not None:
+            file.close()
+
     def upload_complete(self):
         """
         Signal that the upload is complete. Subclasses should perform cleanup
@@ -122,16 +150,127 @@ class FileUploadHandler:
         """
         pass
 
+    def upload_interrupted(self):
+        """
+        Signal that the upload was interrupted by an error (upload_complete()
+        isn't called). Subclasses should give back what they hold for it.
+        """
+        pass
+
+class UploadPolicyViolation(object):
+    """
+    A rule of the upload policy broken by a file: 'content_type', 'extension',
+    'declared_size' or 'size'.
+    """
+    def __init__(self, rule, field_name, file_name, message):
+        self.rule = rule
+        self.field_name = field_name
+        self.file_name = file_name
+        self.message = message
+
+    def __repr__(self):
+        return "<%s: %s %s (%s)>" % (self.__class__.__name__, self.rule, self.file_name, self.message)
+
+class PolicyFileUploadHandler(FileUploadHandler, object):
+    """
+    Upload handler enforcing settings.FILE_UPLOAD_ALLOWED_CONTENT_TYPES,
+    FILE_UPLOAD_ALLOWED_EXTENSIONS and FILE_UPLOAD_MAX_SIZE before the next
+    handlers store anything, so it goes first in FILE_UPLOAD_HANDLERS.
+
+    A file breaking a rule is skipped (SkipFile), or the whole upload stopped
+    (StopUpload) if settings.FILE_UPLOAD_POLICY_ACTION is 'stop', as soon as the
+    violation is seen. The violations are recorded in violations and in the
+    request's upload_policy_violations.
+    """
+    reusable = True
+
+    #transfer encodings that don't change the size of the content
+    IDENTITY_ENCODINGS = ('', '7bit', '8bit', 'binary')
+
+    def __init__(self, request=None):
+        super(PolicyFileUploadHandler, self).__init__(request)
+        self.violations = []
+
+    def reset(self, request=None):
+        super(PolicyFileUploadHandler, self).reset(request)
+        self.violations = []
+        self._received_size = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, settings, encoding=None):
+        self.settings = settings
+
+    def new_file(self, *args, **kwargs):
+        super(PolicyFileUploadHandler, self).new_file(*args, **kwargs)
+        self._received_size = 0
+
+        content_types = self.settings.FILE_UPLOAD_ALLOWED_CONTENT_TYPES
+        if content_types is not None and not content_type_allowed(self.content_type, content_types):
+            self._violate('content_type', "Content-Type %s isn't allowed." % self.content_type)
+
+        extensions = self.settings.FILE_UPLOAD_ALLOWED_EXTENSIONS
+        if extensions is not None:
+            extension = os.path.splitext(self.file_name or '')[1].lower()
+            if extension not in ['.' + allowed.lstrip('.').lower() for allowed in extensions]:
+                self._violate('extension', "Extension %s isn't allowed." % extension)
+
+        #the declared size of a transfer encoded file isn't the size of the file
+        max_size = self.settings.FILE_UPLOAD_MAX_SIZE
+        if max_size is not None and self.content_length is not None and\
+            (self.transfer_encoding or '').lower() in self.IDENTITY_ENCODINGS and\
+            self.content_length > max_size:
+            self._violate('declared_size', "Declared size %d exceeds %d bytes." % (self.content_length, max_size))
+
+    def receive_data_chunk(self, raw_data, start):
+        self._received_size += len(raw_data)
+        max_size = self.settings.FILE_UPLOAD_MAX_SIZE
+        if max_size is not None and self._received_size > max_size:
+            self._violate('size', "File exceeds %d bytes." % max_size)
+        #let the next handlers store it
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def _violate(self, rule, message):
+        violation = UploadPolicyViolation(rule, self.field_name, self.file_name, message)
+        self.violations.append(violation)
+        request_violations = getattr(self.request, 'upload_policy_violations', None)
+        if request_violations is not None:
+            request_violations.append(violation)
+        if self.settings.FILE_UPLOAD_POLICY_ACTION == 'stop':
+            raise StopUpload()
+        raise SkipFile(message)
+
+def content_type_allowed(content_type, allowed_content_types):
+    """
+    Return whether content_type is one of allowed_content_types, which can
+    hold 'major/*' types.
+    """
+    content_type = (content_type or '').lower()
+    major_type = content_type.split('/', 1)[0] + '/*'
+    for allowed in allowed_content_types:
+        allowed = allowed.lower()
+        if allowed == content_type or allowed == major_type:
+            return True
+    return False
+
 class TemporaryFileUploadHandler(FileUploadHandler, object):
     """
     Upload handler that streams data into a temporary file.
     """
+    reusable = True
 
     #QUESTION: There's no handle_raw_input(). Then how's a file upload handled that's
     #not in-memory?
     #ANSWER: handlr_raw_input() is not what is used to handle streaming into a temp file. That
     #would be receive_data_chunk().
 
+    def reset(self, request=None):
+        super(TemporaryFileUploadHandler, self).reset(request)
+        self._pending = []
+        self._pending_size = 0
+        self._writer = None
+
     def handle_raw_input(self, input_data, META, content_length, boundary, settings, encoding=None):
         self.settings = settings
 
@@ -140,20 +279,116 @@ class TemporaryFileUploadHandler(FileUploadHandler, object):
         Create the file object to append to as data is coming in.
         """
         super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
-        self.file = TemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset, self.settings, self.content_type_extra, self.transfer_encoding)
+        self.file = self._create_file()
+        #chunks not written to the file yet
+        self._pending = []
+        self._pending_size = 0
+        #hands the writes to a background thread if there's a writer pool
+        self._writer = None
+        pool = get_writer_pool(self.settings)
+        if pool is not None:
+            self._writer = pool.writer(self.file, write_chunks)
+
+    def _create_file(self):
+        return TemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset, self.settings, self.content_type_extra, self.transfer_encoding)
 
     def receive_data_chunk(self, raw_data, start):
-        self.file.write(raw_data)
+        #coalesce small chunks into fewer, larger writes
+        self._pending.append(raw_data)
+        self._pending_size += len(raw_data)
+        if self._pending_size >= self.settings.FILE_UPLOAD_WRITE_BUFFER_SIZE:
+            self._write_pending()
+
+    def _write_pending(self):
+        if self._writer is not None:
+            if self._pending:
+                self._writer.write(self._pending)
+        else:
+            write_chunks(self.file, self._pending)
+        self._pending = []
+        self._pending_size = 0
 
     def file_complete(self, file_size):
+        #the error of a write done by the writer thread is raised here
+        self._write_pending()
+        if self._writer is not None:
+            self._writer.wait()
+            self._writer = None
         self.file.seek(0)
         self.file.size = file_size
         return self.file
 
+    def free_file(self):
+        self._cancel_writes()
+        super(TemporaryFileUploadHandler, self).free_file()
+
+    def upload_interrupted(self):
+        self._cancel_writes()
+
+    def _cancel_writes(self):
+        #nothing is written to the file once it's given up on
+        self._pending = []
+        self._pending_size = 0
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            writer.cancel()
+
+class CompressingFileUploadHandler(TemporaryFileUploadHandler, object):
+    """
+    Upload handler that streams data into a temporary file through the
+    compression codec settings.FILE_UPLOAD_COMPRESSION gives to the file's
+    content type. The files it returns are CompressedUploadedFile, or
+    TemporaryUploadedFile for the content types that aren't compressed.
+    """
+    reusable = True
+
+    def reset(self, request=None):
+        super(CompressingFileUploadHandler, self).reset(request)
+        self._codec = None
+        self._compressor = None
+        self._stored_size = 0
+
+    def _create_file(self):
+        self._codec = compression_codec(self.content_type, self.settings.FILE_UPLOAD_COMPRESSION)
+        self._compressor = self._codec.compressor() if self._codec is not None else None
+        self._stored_size = 0
+        if self._codec is None:
+            return super(CompressingFileUploadHandler, self)._create_file()
+        return CompressedUploadedFile(self.file_name, self.content_type, 0, self.charset, self._codec,
+                                      self.settings, self.content_type_extra, self.transfer_encoding)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self._compressor is not None:
+            raw_data = self._compressor.compress(raw_data)
+            if not raw_data:
+                return
+        self._stored_size += len(raw_data)
+        super(CompressingFileUploadHandler, self).receive_data_chunk(raw_data, self._stored_size - len(raw_data))
+
+    def file_complete(self, file_size):
+        if self._compressor is None:
+            return super(CompressingFileUploadHandler, self).file_complete(file_size)
+
+        tail = self._compressor.flush()
+        self._stored_size += len(tail)
+        super(CompressingFileUploadHandler, self).receive_data_chunk(tail, self._stored_size - len(tail))
+        uploaded_file = super(CompressingFileUploadHandler, self).file_complete(self._stored_size)
+        uploaded_file.stored_size = self._stored_size
+        uploaded_file.size = file_size
+        return uploaded_file
+
 class MemoryFileUploadHandler(FileUploadHandler, object):
     """
     File upload handler to stream uploads into memory (used for small files).
     """
+    reusable = True
+
+    def reset(self, request=None):
+        super(MemoryFileUploadHandler, self).reset(request)
+        if getattr(self, '_reservation', None) is not None:
+            self._reservation.release()
+        self.activated = False
+        self._reservation = None
 
     def handle_raw_input(self, input_data, META, content_length, boundary, settings, encoding=None):
         """
@@ -164,6 +399,13 @@ class MemoryFileUploadHandler(FileUploadHandler, object):
         # If the post is too large, we cannot use the Memory handler.
         self.activated = content_length <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE
 
+        #the whole post must also fit in the process-wide memory budget, if any
+        self._reservation = None
+        budget = get_memory_budget(settings)
+        if self.activated and budget is not None:
+            self._reservation = MemoryReservation(budget)
+            self.activated = self._reservation.reserve(content_length)
+
     def new_file(self, *args, **kwargs):
         super(MemoryFileUploadHandler, self).new_file(*args, **kwargs)
         if self.activated:
@@ -191,9 +433,82 @@ class MemoryFileUploadHandler(FileUploadHandler, object):
             size=file_size,
             charset=self.charset,
             content_type_extra=self.content_type_extra,
-            transfer_encoding=self.transfer_encoding
+            transfer_encoding=self.transfer_encoding,
+            memory_reservation=self._reservation.split(file_size) if self._reservation else None
         )
 
+    def upload_complete(self):
+        #give back what the files didn't use
+        if self._reservation is not None:
+            self._reservation.release()
+
+    def upload_interrupted(self):
+        self.upload_complete()
+
+class DestinationFileUploadHandler(FileUploadHandler, object):
+    """
+    Upload handler that streams files straight into
+    settings.FILE_UPLOAD_DESTINATION_DIR so that they don't have to be copied
+    out of a temporary file afterwards.
+
+    A file is written under a hidden partial name and renamed to the name
+    given by settings.FILE_UPLOAD_DESTINATION_NAME once complete; skipped or
+    aborted files are removed.
+    """
+    reusable = True
+
+    def reset(self, request=None):
+        super(DestinationFileUploadHandler, self).reset(request)
+        self.activated = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, settings, encoding=None):
+        self.settings = settings
+        #without a destination the files are left to the next handlers
+        self.activated = settings.FILE_UPLOAD_DESTINATION_DIR is not None
+
+    def new_file(self, *args, **kwargs):
+        super(DestinationFileUploadHandler, self).new_file(*args, **kwargs)
+        if self.activated:
+            self.file = DestinationUploadedFile(self.file_name, self.content_type, 0, self.charset,
+                                                self.destination_path(), self.content_type_extra,
+                                                self.transfer_encoding)
+            raise StopFutureHandlers()
+
+    def destination_path(self):
+        """
+        Return the path the file being received is stored at.
+        """
+        get_name = self.settings.FILE_UPLOAD_DESTINATION_NAME
+        if get_name is not None:
+            name = get_name(self.field_name, self.file_name, self.content_type)
+        else:
+            name = uuid.uuid4().hex + os.path.splitext(self.file_name or '')[1]
+        #the name can't leave the destination directory
+        return os.path.join(self.settings.FILE_UPLOAD_DESTINATION_DIR, os.path.basename(name))
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated:
+            self.file.write(raw_data)
+        else:
+            return raw_data
+
+    def file_complete(self, file_size):
+        if not self.activated:
+            return
+
+        try:
+            self.file.finalize()
+        except (IOError, OSError) as e:
+            self.file.close()
+            #a complete file is never replaced
+            if e.errno == errno.EEXIST:
+                from request_parser.http.multipartparser import MultiPartParserError
+                raise MultiPartParserError("Destination file %s already exists." % self.file.destination_path)
+            raise
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
 class ConvenientFileUploadHandler(FileUploadHandler, object):
     """
     A wrapper class that conveniently switches to TemporaryFileUploadHandler from MemoryFileUploadHandler
@@ -204,52 +519,101 @@ class ConvenientFileUploadHandler(FileUploadHandler, object):
 
     It's also easier to implement the functionalities this way while maintaining API compatibility.
     """
+    reusable = True
 
     def __init__(self, request=None):
+        super(ConvenientFileUploadHandler, self).__init__(request)
         self._request = request
-        self._handler = MemoryFileUploadHandler(request)
+        self._memory_handler = MemoryFileUploadHandler(request)
+        self._handler = self._memory_handler
         self._received_data_size = 0
         self._switched_to_temp_file = False
+        #MemoryReservation of the file being received in memory
+        self._reservation = None
+
+    def reset(self, request=None):
+        super(ConvenientFileUploadHandler, self).reset(request)
+        self._request = request
+        self._memory_handler.reset(request)
+        self._handler = self._memory_handler
+        self._received_data_size = 0
+        self._switched_to_temp_file = False
+        self._release_reservation()
+        self._content_length = None
+        self._budget = None
     
     def handle_raw_input(self, input_data, META, content_length, boundary, settings, encoding=None):
         #We grab the settings object and call the handler's handle_raw_input to activate it.
         self._settings = settings
+        self._content_length = content_length
+        self._budget = get_memory_budget(settings)
         
         #we pass the content_length arg to 0 so that the MemoryFileUploadHandler can be activated
-        self._handler.handle_raw_input(input_data, META, 0, boundary, settings, encoding)
+        self._memory_handler.handle_raw_input(input_data, META, 0, boundary, settings, encoding)
     
     def new_file(self, *args, **kwargs):
+        super(ConvenientFileUploadHandler, self).new_file(*args, **kwargs)
+
+        #every file starts in memory...
+        self._release_reservation()
+        self._received_data_size = 0
+        self._switched_to_temp_file = False
+        self._handler = self._memory_handler
+        if self._budget is not None:
+            self._reservation = MemoryReservation(self._budget)
+
+        #...unless it declares a size that can't be held in memory
+        if self.content_length is not None and\
+            self.content_length > self._settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            self._rollover()
+            raise StopFutureHandlers()
+
         self._handler.new_file(*args, **kwargs)
-    
-    def receive_data_chunk(self, raw_data, start):
-        current_data_size = len(raw_data)
-        
-        #check if switching to temp file is required
-        if not self._switched_to_temp_file and\
-        self._received_data_size + current_data_size > self._settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
-            #signal close of file_upload to current handler and
-            #get a InMemoryUploadedFile object
-            current_content_file = self.file_complete(self._received_data_size)
-            content = current_content_file.read()
 
-            #create a new temporary file now that the max size for in-memory
-            #handling has exceeded
-            temp_upload_handler = TemporaryFileUploadHandler(self._request)
+    def _rollover(self):
+        """
+        Switch the current file from memory to a TemporaryFileUploadHandler.
 
-            #activate it
-            temp_upload_handler.handle_raw_input(None, None, 0, None, self._settings)
+        What has been received so far is handed to the temp file handler in
+        chunk_size pieces, like the chunks that follow, so that it goes
+        through the same write buffer and writer thread.
+        """
+        #create a new temporary file now that the max size for in-memory
+        #handling has exceeded
+        temp_upload_handler = TemporaryFileUploadHandler(self._request)
 
-            #create a new file
-            temp_upload_handler.new_file(self._handler.field_name, self._handler.file_name, self._handler.content_type, 0, self._handler.charset, self._handler.content_type_extra, self._handler.transfer_encoding)
+        #activate it
+        temp_upload_handler.handle_raw_input(None, None, self._content_length, None, self._settings)
 
-            #stream all of the read data into the temp file
-            temp_upload_handler.receive_data_chunk(content, 0)
+        #create a new file
+        temp_upload_handler.new_file(self.field_name, self.file_name, self.content_type, self.content_length,
+                                     self.charset, self.content_type_extra, self.transfer_encoding)
 
-            #reset the current file handler
-            self._handler = temp_upload_handler
+        if self._received_data_size:
+            memory_file = self._handler.file
+            memory_file.seek(0)
+            start = 0
+            for chunk in iter(lambda: memory_file.read(self.chunk_size), b''):
+                temp_upload_handler.receive_data_chunk(chunk, start)
+                start += len(chunk)
+            memory_file.close()
+        self._release_reservation()
 
-            #flag that we've switched to temp file
-            self._switched_to_temp_file = True
+        #reset the current file handler
+        self._handler = temp_upload_handler
+
+        #flag that we've switched to temp file
+        self._switched_to_temp_file = True
+
+    def receive_data_chunk(self, raw_data, start):
+        current_data_size = len(raw_data)
+        
+        #check if switching to temp file is required, either because the
+        #file is too large or because the memory budget is exhausted
+        if not self._switched_to_temp_file and\
+        (self._received_data_size + current_data_size > self._settings.FILE_UPLOAD_MAX_MEMORY_SIZE or
+         self._reservation is not None and not self._reservation.reserve(current_data_size)):
+            self._rollover()
         
         #stream the raw into the current handle
         self._handler.receive_data_chunk(raw_data, start)
@@ -257,11 +621,39 @@ class ConvenientFileUploadHandler(FileUploadHandler, object):
         self._received_data_size += current_data_size
     
     def file_complete(self, file_size):
-        return self._handler.file_complete(file_size)
+        uploaded_file = self._handler.file_complete(file_size)
+        if not self._switched_to_temp_file and uploaded_file is not None:
+            #the file keeps the memory reserved until it's closed
+            uploaded_file.memory_reservation = self._reservation
+            self._reservation = None
+        return uploaded_file
 
     def upload_complete(self):
+        #an aborted file gives back its memory
+        self._release_reservation()
         self._handler.upload_complete()
 
+    def free_file(self):
+        self._handler.free_file()
+
+    def upload_interrupted(self):
+        self._release_reservation()
+        self._handler.upload_interrupted()
+
+    def _release_reservation(self):
+        if self._reservation is not None:
+            self._reservation.release()
+            self._reservation = None
+
+def write_chunks(file, chunks):
+    """
+    Write the list of chunks to file with a single write.
+    """
+    if len(chunks) == 1:
+        file.write(chunks[0])
+    elif chunks:
+        file.write(b''.join(chunks))
+
 def load_handler(path, *args, **kwargs):
     """
     Given a path to a handler, return an instance of that handler.
@@ -273,3 +665,75 @@ def load_handler(path, *args, **kwargs):
         <TemporaryFileUploadHandler object at 0x...>
     """
     return import_string(path)(*args, **kwargs)
+
+class UploadHandlerRegistry(object):
+    """
+    The upload handler classes of a list of dotted paths, imported once, and
+    the factory of the handler chains made of them.
+
+    Reusable handlers given back with release() are reset, so that they
+    don't keep the request and its files alive, and handed out again instead
+    of being created anew.
+    """
+    #maximum number of idle handlers kept for each class
+    max_pool_size = 64
+
+    def __init__(self, paths):
+        self.paths = tuple(paths)
+        self.classes = tuple(import_string(path) for path in self.paths)
+        #reusable isn't inherited: a subclass may have state its parents'
+        #reset() misses
+        self._pools = dict((handler_class, []) for handler_class in self.classes
+                           if handler_class.__dict__.get('reusable', False))
+        self._lock = threading.Lock()
+
+    def handlers(self, request=None):
+        """
+        Return a new chain of handlers for request.
+        """
+        handlers = []
+        for handler_class in self.classes:
+            handler = None
+            pool = self._pools.get(handler_class)
+            if pool:
+                with self._lock:
+                    if pool:
+                        handler = pool.pop()
+            if handler is not None:
+                handler.reset(request)
+            else:
+                handler = handler_class(request)
+            handlers.append(handler)
+        return handlers
+
+    def release(self, handlers):
+        """
+        Take back handlers returned by handlers() once the request is done
+        with them.
+        """
+        for handler in handlers:
+            pool = self._pools.get(type(handler))
+            if pool is None:
+                continue
+            handler.reset(None)
+            with self._lock:
+                if len(pool) < self.max_pool_size:
+                    pool.append(handler)
+
+#registries shared by the whole process, by tuple of dotted paths
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_handler_registry(settings):
+    """
+    Return the process-wide UploadHandlerRegistry of
+    settings.FILE_UPLOAD_HANDLERS.
+    """
+    paths = tuple(settings.FILE_UPLOAD_HANDLERS)
+    registry = _registries.get(paths)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(paths)
+            if registry is None:
+                registry = _registries[paths] = UploadHandlerRegistry(paths)
+    return registry
@@ -0,0 +1,127 @@
+"""
+Threads writing uploaded files to disk in the background.
+
+A disk-backed upload handler hands the chunks it receives to a
+``QueuedFileWriter`` so that the request thread goes on parsing the next
+chunks while the previous ones are written. Each file is written by a single
+thread, in order; the queues are bounded so a parser faster than the disk
+waits for it.
+"""
+import itertools
+import sys
+import threading
+
+from six import reraise as raise_
+from six.moves import queue
+
+__all__ = ('WriterPool', 'QueuedFileWriter', 'get_writer_pool')
+
+class QueuedFileWriter(object):
+    """
+    Writes to a file done by a thread of a WriterPool.
+    """
+    def __init__(self, file, write_queue, write):
+        self.file = file
+        self._queue = write_queue
+        #called with file and the data handed to write()
+        self._write = write
+        #exc_info of a failed write
+        self._error = None
+        #set by cancel()
+        self._cancelled = False
+
+    def write(self, data):
+        """
+        Queue data to be written, waiting while the queue is full.
+
+        The error of a previous write is raised here.
+        """
+        self._raise_error()
+        self._queue.put((self, data, None))
+
+    def wait(self):
+        """
+        Wait for the writes queued so far to be done.
+        """
+        done = threading.Event()
+        self._queue.put((self, None, done))
+        done.wait()
+        self._raise_error()
+
+    def cancel(self):
+        """
+        Drop the writes queued so far, and their errors, and wait for the one
+        being done so that the file can be closed.
+        """
+        self._cancelled = True
+        done = threading.Event()
+        self._queue.put((self, None, done))
+        done.wait()
+        self._error = None
+
+    def _run(self, data, done):
+        if done is not None:
+            done.set()
+        #the writes after a failed one, or once cancelled, are dropped
+        elif self._error is None and not self._cancelled:
+            try:
+                self._write(self.file, data)
+            except Exception:
+                self._error = sys.exc_info()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise_(*error)
+
+class WriterPool(object):
+    """
+    A number of writer threads, each draining its own bounded queue of
+    writes. The threads are started on first use.
+    """
+    def __init__(self, threads, queue_size):
+        self._queues = [queue.Queue(maxsize=queue_size) for i in range(threads)]
+        self._started = False
+        self._lock = threading.Lock()
+        #files are given to the threads in turn
+        self._next_queue = itertools.cycle(self._queues)
+
+    def writer(self, file, write):
+        """
+        Return a QueuedFileWriter calling write(file, data) in a thread of the
+        pool for each write(data).
+        """
+        with self._lock:
+            if not self._started:
+                for write_queue in self._queues:
+                    thread = threading.Thread(target=self._drain, args=(write_queue,), name='WriterPool')
+                    thread.daemon = True
+                    thread.start()
+                self._started = True
+            write_queue = next(self._next_queue)
+        return QueuedFileWriter(file, write_queue, write)
+
+    @staticmethod
+    def _drain(write_queue):
+        while True:
+            writer, data, done = write_queue.get()
+            writer._run(data, done)
+
+#pools shared by the whole process, by number of threads and queue size
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_writer_pool(settings):
+    """
+    Return the process-wide WriterPool of settings.FILE_UPLOAD_WRITER_THREADS
+    threads, None when files are written by the request thread.
+    """
+    threads = settings.FILE_UPLOAD_WRITER_THREADS
+    if not threads:
+        return None
+    key = (threads, settings.FILE_UPLOAD_WRITER_QUEUE_SIZE)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = WriterPool(*key)
+        return pool
@@ -0,0 +1,330 @@
+"""
+Offset index of the parts of a multipart body stored in a file.
+
+Exposes ``MultiPartIndex`` which scans a file-backed multipart/form-data body
+once and records where each part's headers and payload are. The index can be
+saved and loaded back so that later accesses seek straight to a part instead
+of parsing the whole body again; the body's size and the delimiters after the
+parts are checked before an index is used on a file, so that a stale index
+isn't silently read at the wrong offsets.
+"""
+import json
+
+from request_parser.http.constants import MetaDict
+from request_parser.http.multipartparser import (
+    MultiPartParserError, RAW, FILE, parse_header, parse_part_header
+)
+from request_parser.utils.encoding import force_text
+
+__all__ = ('MultiPartIndex', 'PartIndexEntry', 'PartReader')
+
+#version of the persisted index format
+INDEX_FORMAT_VERSION = 1
+
+class PartIndexEntry:
+    """
+    Location and headers of one part of an indexed multipart body.
+
+    All the offsets are absolute positions in the file, end offsets are
+    exclusive.
+    """
+    FIELDS = ('name', 'filename', 'content_type', 'transfer_encoding',
+              'header_start', 'header_end', 'data_start', 'data_end')
+
+    def __init__(self, name, filename, content_type, transfer_encoding,
+                 header_start, header_end, data_start, data_end):
+        self.name = name
+        #None for a field
+        self.filename = filename
+        self.content_type = content_type
+        self.transfer_encoding = transfer_encoding
+        self.header_start = header_start
+        self.header_end = header_end
+        self.data_start = data_start
+        self.data_end = data_end
+
+    @property
+    def is_file(self):
+        return self.filename is not None
+
+    @property
+    def size(self):
+        """
+        Size of the (still transfer encoded) payload.
+        """
+        return self.data_end - self.data_start
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in PartIndexEntry.FIELDS)
+
+    @classmethod
+    def from_dict(cls, entry_dict):
+        return cls(*[entry_dict[field] for field in PartIndexEntry.FIELDS])
+
+    def __eq__(self, other):
+        return isinstance(other, PartIndexEntry) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<%s: %s [%d:%d]>" % (self.__class__.__name__, self.name, self.data_start, self.data_end)
+
+class PartReader:
+    """
+    File-like access to the payload of an indexed part.
+
+    Reads seek to the part first so several readers can share the file.
+    """
+    def __init__(self, flo, entry, chunk_size=64 * 2 ** 10):
+        self._flo = flo
+        self._position = entry.data_start
+        self._end = entry.data_end
+        self.chunk_size = chunk_size
+
+    def read(self, size=None):
+        """
+        Read up to size bytes of the payload, all of it if size is None.
+        """
+        remaining = self._end - self._position
+        if size is not None and size < remaining:
+            remaining = size
+        if remaining <= 0:
+            return b''
+        self._flo.seek(self._position)
+        data = self._flo.read(remaining)
+        self._position += len(data)
+        return data
+
+    def __iter__(self):
+        return self
+
+    #def __next__(self):
+    def next(self):
+        data = self.read(self.chunk_size)
+        if not data:
+            raise StopIteration()
+        return data
+
+class MultiPartIndex:
+    """
+    Index of the parts (fields and files) of a multipart body stored in a
+    seekable file.
+    """
+    def __init__(self, boundary, body_offset, entries, body_size=None):
+        self.boundary = boundary
+        #where the body starts in the file
+        self.body_offset = body_offset
+        self.entries = entries
+        #size of the body (to the end of the file), None if unknown
+        self.body_size = body_size
+        #the file last checked by validate()
+        self._validated_flo = None
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __eq__(self, other):
+        return isinstance(other, MultiPartIndex) and\
+            (self.boundary, self.body_offset, self.body_size, self.entries) ==\
+            (other.boundary, other.body_offset, other.body_size, other.entries)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def get(self, name):
+        """
+        Return the entries of the parts named name.
+        """
+        return [entry for entry in self.entries if entry.name == name]
+
+    def open(self, flo, entry):
+        """
+        Return a PartReader over the payload of entry in flo.
+        """
+        self._validate_once(flo)
+        return PartReader(flo, entry)
+
+    def read(self, flo, entry):
+        """
+        Return the (still transfer encoded) payload of entry in flo.
+        """
+        self._validate_once(flo)
+        return PartReader(flo, entry).read()
+
+    def validate(self, flo):
+        """
+        Check that this index describes the body in flo: the body has the
+        indexed size and each indexed payload is followed by a delimiter.
+
+        Raise MultiPartParserError if it doesn't.
+        """
+        if self.body_size is not None:
+            flo.seek(0, 2)
+            body_size = flo.tell() - self.body_offset
+            if body_size != self.body_size:
+                raise MultiPartParserError("Stale multipart index: the body is %d bytes, %d are indexed."
+                                           % (body_size, self.body_size))
+        separator = b'--' + self.boundary.encode('ascii')
+        for entry in self.entries:
+            flo.seek(entry.data_end)
+            #the delimiter follows the line break ending the payload
+            delimiter = flo.read(len(separator) + 2)
+            if not (delimiter.startswith(b'\r\n' + separator) or delimiter.startswith(b'\n' + separator)):
+                raise MultiPartParserError("Stale multipart index: no delimiter after part %s." % entry.name)
+        self._validated_flo = flo
+
+    def _validate_once(self, flo):
+        if flo is not self._validated_flo:
+            self.validate(flo)
+
+    @classmethod
+    def build(cls, flo, boundary, body_offset=0, encoding='utf-8',
+              chunk_size=64 * 2 ** 10, max_header_size=8192):
+        """
+        Index the multipart body with the given boundary which starts at
+        body_offset in the seekable file-like object flo.
+
+        The body is scanned once for the delimiters, then only the headers
+        of each part are read.
+        """
+        separator = b'--' + boundary
+        delimiters = cls._find_delimiters(flo, separator, body_offset, chunk_size)
+
+        entries = []
+        for (__, position), (next_line_start, __) in zip(delimiters, delimiters[1:]):
+            header_start = position + len(separator)
+            flo.seek(header_start)
+            header = flo.read(min(next_line_start - header_start, max_header_size + 4))
+            #the close delimiter ends the body
+            if header[:2] == b'--':
+                break
+            header_end = header.find(b'\r\n\r\n')
+            if header_end == -1 or header_end > max_header_size:
+                continue
+            #the headers start after the line break ending the delimiter line
+            line_end = header.find(b'\n') + 1
+
+            item_type, meta_data = parse_part_header(header[:header_end])
+            if item_type == RAW:
+                continue
+            try:
+                disposition = meta_data['content-disposition'][1]
+                name = force_text(disposition['name'].strip(), encoding, errors='replace')
+            except (KeyError, IndexError, AttributeError):
+                continue
+
+            filename = None
+            if item_type == FILE:
+                filename = force_text(disposition['filename'], encoding, errors='replace')
+            content_type = meta_data.get('content-type', ('', {}))[0]
+            transfer_encoding = meta_data.get('content-transfer-encoding', (None, {}))[0]
+            if transfer_encoding is not None:
+                transfer_encoding = force_text(transfer_encoding.strip(), encoding, errors='replace')
+
+            entries.append(PartIndexEntry(
+                name, filename, force_text(content_type.strip(), encoding, errors='replace'), transfer_encoding,
+                header_start + line_end, header_start + header_end, header_start + header_end + 4, next_line_start
+            ))
+
+        flo.seek(0, 2)
+        body_size = flo.tell() - body_offset
+        return cls(force_text(boundary, 'ascii'), body_offset, entries, body_size)
+
+    @staticmethod
+    def _find_delimiters(flo, separator, body_offset, chunk_size):
+        """
+        Return (line_start, position) pairs for each separator at the start of
+        a line of the body: position is where the separator is and line_start
+        where the line break in front of it is.
+        """
+        delimiters = []
+        flo.seek(body_offset)
+        #absolute position of buffer[0]
+        buffer_start = body_offset
+        buffer = b''
+        while True:
+            chunk = flo.read(chunk_size)
+            if not chunk:
+                break
+            search_start = len(buffer)
+            buffer += chunk
+            #a separator straddling the previous chunk starts at most this far back
+            index = buffer.find(separator, max(0, search_start - len(separator) + 1))
+            while index != -1:
+                position = buffer_start + index
+                if position == body_offset:
+                    delimiters.append((position, position))
+                elif index > 0 and buffer[index - 1:index] == b'\n':
+                    line_start = position - 1
+                    if index > 1 and buffer[index - 2:index - 1] == b'\r':
+                        line_start -= 1
+                    delimiters.append((line_start, position))
+                index = buffer.find(separator, index + 1)
+            #keep what's needed to recognize a separator (and the CRLF in
+            #front of it) that starts in this chunk
+            keep = min(len(buffer), len(separator) + 1)
+            buffer_start += len(buffer) - keep
+            buffer = buffer[len(buffer) - keep:]
+        return delimiters
+
+    @classmethod
+    def from_request(cls, flo, settings=None, **kwargs):
+        """
+        Index the multipart/form-data body of the HTTP request stored in the
+        seekable file-like object flo.
+        """
+        from request_parser.http.request import HttpRequest
+
+        flo.seek(0)
+        request = HttpRequest(flo, settings)
+        request.parse_request_header()
+        if request.content_type != 'multipart/form-data':
+            raise MultiPartParserError('Invalid Content-Type: %s' % request.content_type)
+
+        content_type = request.META[MetaDict.Info.REQ_HEADERS].get('Content-Type', '')
+        boundary = parse_header(content_type.encode('ascii'))[1].get('boundary')
+        if not boundary:
+            raise MultiPartParserError('Invalid boundary in multipart: %s' % boundary)
+        #the body starts where the request has read up to
+        body_offset = request.tell()
+        return cls.build(flo, boundary, body_offset, request.encoding, **kwargs)
+
+    def to_dict(self):
+        return {
+            'version' : INDEX_FORMAT_VERSION,
+            'boundary' : self.boundary,
+            'body_offset' : self.body_offset,
+            'body_size' : self.body_size,
+            'parts' : [entry.to_dict() for entry in self.entries]
+        }
+
+    @classmethod
+    def from_dict(cls, index_dict):
+        if index_dict.get('version') != INDEX_FORMAT_VERSION:
+            raise ValueError("Unsupported multipart index version: %r" % index_dict.get('version'))
+        return cls(index_dict['boundary'], index_dict['body_offset'],
+                   [PartIndexEntry.from_dict(entry) for entry in index_dict['parts']],
+                   index_dict.get('body_size'))
+
+    def save(self, path):
+        """
+        Persist the index as JSON in path.
+        """
+        with open(path, 'w') as index_file:
+            json.dump(self.to_dict(), index_file)
+
+    @classmethod
+    def load(cls, path, flo=None):
+        """
+        Load an index saved with save(), validated against the body in flo
+        if it's given (it is anyway before it's first read from).
+        """
+        with open(path, 'r') as index_file:
+            index = cls.from_dict(json.load(index_file))
+        if flo is not None:
+            index.validate(flo)
+        return index
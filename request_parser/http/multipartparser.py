@@ -21,9 +21,9 @@ from request_parser.files.uploadhandler import (
 from request_parser.utils.datastructures import MultiValueDict
 from request_parser.utils.encoding import force_text
 from request_parser.utils.text import unescape_entities
-from request_parser.utils.datastructures import LazyStream, ChunkIter
+from request_parser.utils.datastructures import LazyStream, ChunkIter, skip_file
 
-__all__ = ('MultiPartParser', 'MultiPartParserError', 'InputStreamExhausted')
+__all__ = ('MultiPartParser', 'MultiPartParserError', 'InputStreamExhausted', 'Part', 'FieldValue')
 
 class MultiPartParserError(Exception):
     pass
@@ -32,6 +32,9 @@ RAW = "raw"
 FILE = "file"
 FIELD = "field"
 
+#how deep multipart parts nested in multipart parts are parsed
+MAX_NESTING_DEPTH = 4
+
 class MultiPartParser:
     """
     A rfc2388 multipart/form-data parser.
@@ -39,7 +42,7 @@ class MultiPartParser:
     ``MultiValueDict.parse()`` reads the input stream in ``chunk_size`` chunks
     and returns a tuple of ``(MultiValueDict(POST), MultiValueDict(FILES))``.
     """
-    def __init__(self, META, input_data, upload_handlers, settings, encoding=None):
+    def __init__(self, META, input_data, upload_handlers, settings, encoding=None, fields=None):
         """
         Initialize the MultiPartParser object.
 
@@ -52,6 +55,11 @@ class MultiPartParser:
             uploaded data.
         :encoding:
             The encoding with which to treat the incoming data.
+        :fields:
+            The names of the parts to parse, or a callable taking a part's
+            name and headers (meta_data) and returning whether to parse it.
+            The other parts are skipped without being decoded or handed to
+            the upload handlers. All the parts are parsed if None.
         """
         self.settings = settings
 
@@ -91,6 +99,16 @@ class MultiPartParser:
         self._encoding = encoding or self.settings.DEFAULT_CHARSET
         self._content_length = content_length
         self._upload_handlers = upload_handlers
+        #handlers that started the file being received
+        self._file_handlers = []
+
+        if fields is None or callable(fields):
+            self._select = fields
+        else:
+            field_names = frozenset(fields)
+            def select(field_name, meta_data):
+                return field_name in field_names
+            self._select = select
 
     def parse(self):
         """
@@ -98,17 +116,32 @@ class MultiPartParser:
         MultiValueDict.
 
         Return a tuple containing the POST and FILES dictionary, respectively.
+
+        If parsing fails, the handlers' upload_interrupted() is called instead
+        of upload_complete().
         """
         from request_parser.http.request import QueryDict
 
-        encoding = self._encoding
-        handlers = self._upload_handlers
-
         # HTTP spec says that Content-Length >= 0 is valid
         # handling content-length == 0 before continuing
         if self._content_length == 0:
             return QueryDict(self.settings, encoding=self._encoding), MultiValueDict()
 
+        interrupted = True
+        try:
+            result = self._parse()
+            interrupted = False
+            return result
+        finally:
+            if interrupted:
+                self._interrupt_upload()
+
+    def _parse(self):
+        from request_parser.http.request import QueryDict
+
+        encoding = self._encoding
+        handlers = self._upload_handlers
+
         # See if any of the handlers take care of the parsing.
         # This allows overriding everything if need be.
         for handler in handlers:
@@ -132,8 +165,8 @@ class MultiPartParser:
         self._post = QueryDict(self.settings, mutable=True)
         self._files = MultiValueDict()
 
-        # Instantiate the stream:
-        stream = LazyStream(ChunkIter(self._input_data, self._chunk_size))
+        input_start = self._input_position()
+        parts = self._parts()
 
         # Whether or not to signal a file-completion at the beginning of the loop.
         old_field_name = None
@@ -147,7 +180,7 @@ class MultiPartParser:
         read_size = None
 
         try:
-            for item_type, meta_data, field_stream in Parser(stream, self._boundary):
+            for item_type, meta_data, field_stream in parts:
                 if old_field_name:
                     # We run this at the beginning of the next loop
                     # since we cannot be sure a file is complete until
@@ -161,6 +194,20 @@ class MultiPartParser:
                 except (KeyError, IndexError, AttributeError):
                     continue
 
+                if self._select is not None and not self._select(field_name, meta_data):
+                    # Skipped parts still count towards DATA_UPLOAD_MAX_NUMBER_FIELDS
+                    # so that forms stuffed with junk parts are rejected early.
+                    num_post_keys += 1
+                    if (self.settings.DATA_UPLOAD_MAX_NUMBER_FIELDS is not None and
+                            self.settings.DATA_UPLOAD_MAX_NUMBER_FIELDS < num_post_keys):
+                        raise TooManyFieldsSent(
+                            'The number of GET/POST parameters exceeded '
+                            'settings.DATA_UPLOAD_MAX_NUMBER_FIELDS.'
+                        )
+                    # Skip the raw bytes of the part, nothing is decoded.
+                    exhaust(field_stream)
+                    continue
+
                 transfer_encoding = meta_data.get('content-transfer-encoding')
                 if transfer_encoding is not None:
                     transfer_encoding = transfer_encoding[0].strip()
@@ -182,14 +229,15 @@ class MultiPartParser:
                         read_size = self.settings.DATA_UPLOAD_MAX_MEMORY_SIZE - num_bytes_read
 
                     # This is a post field, we can just set it in the post
-                    if transfer_encoding == 'base64':
+                    decoder = get_transfer_decoder(transfer_encoding)
+                    if decoder is not None:
                         #read only for the remaining size
                         raw_data = field_stream.read(size=read_size)
                         num_bytes_read += len(raw_data)
                         try:
                             #decode the data read
-                            data = base64.b64decode(raw_data)
-                        except binascii.Error:
+                            data = decoder.decode(raw_data) + decoder.flush()
+                        except (MultiPartParserError, binascii.Error):
                             data = raw_data
                     else:
                         data = field_stream.read(size=read_size)
@@ -211,13 +259,8 @@ class MultiPartParser:
                     content_type = content_type.strip()
                     #print "data: "+data+"\r\ntype: "+content_type+"\r\nt.encoding: "+transfer_encoding
                     #self._post.appendlist(field_name, force_text(data, encoding, errors='replace'))
-                    self._post.appendlist(field_name, {
-                                                        'data' : force_text(data, encoding, errors='replace'),
-                                                        'content-type' : force_text(content_type, encoding, errors='replace'),
-                                                        'transfer-encoding' : transfer_encoding,
-                                                        'content-type-extra': content_type_extra
-                                                      }
-                    )
+                    self._post.appendlist(field_name, FieldValue(data, content_type, transfer_encoding,
+                                                                 content_type_extra, encoding))
                 elif item_type == FILE:
                     # This is a file, use the handler...
                     file_name = disposition.get('filename')
@@ -231,12 +274,10 @@ class MultiPartParser:
                     content_type = content_type.strip()
                     charset = content_type_extra.get('charset')
 
-                    try:
-                        content_length = int(meta_data.get('content-length')[0])
-                    except (IndexError, TypeError, ValueError):
-                        content_length = None
+                    content_length = declared_content_length(meta_data)
 
                     counters = [0] * len(handlers)
+                    self._file_handlers = []
                     try:
                         for handler in handlers:
                             try:
@@ -248,28 +289,17 @@ class MultiPartParser:
                             #if a handler is handling a new file, it raises StopFutureHandlers
                             #to prevent others from handling it
                             except StopFutureHandlers:
+                                self._file_handlers.append(handler)
                                 break
+                            self._file_handlers.append(handler)
 
-                        for chunk in field_stream:
-                            if transfer_encoding == 'base64':
-                                # We only special-case base64 transfer encoding
-                                # We should always decode base64 chunks by multiple of 4,
-                                # ignoring whitespace.
-
-                                stripped_chunk = b"".join(chunk.split())
-
-                                remaining = len(stripped_chunk) % 4
-                                while remaining != 0:
-                                    over_chunk = field_stream.read(4 - remaining)
-                                    stripped_chunk += b"".join(over_chunk.split())
-                                    remaining = len(stripped_chunk) % 4
-
-                                try:
-                                    chunk = base64.b64decode(stripped_chunk)
-                                except Exception as exc:
-                                    # Since this is only a chunk, any error is an unfixable error.                                
-                                    raise_from(MultiPartParserError("Could not decode base64 data."), exc)
+                        chunks = field_stream
+                        decoder = get_transfer_decoder(transfer_encoding)
+                        if decoder is not None:
+                            #decode the chunks as they come, whatever their size
+                            chunks = decoder.decode_iter(field_stream)
 
+                        for chunk in chunks:
                             for i, handler in enumerate(handlers):
                                 chunk_length = len(chunk)
                                 #stream data into the temp file
@@ -292,7 +322,13 @@ class MultiPartParser:
                         old_field_name = field_name
                 else:
                     # If this is neither a FIELD or a FILE, just exhaust the stream.
-                    exhaust(stream)
+                    exhaust(field_stream)
+
+            # The last file is complete if no part (the epilogue
+            # for instance) follows it.
+            if old_field_name:
+                self.handle_file_complete(old_field_name, counters)
+                old_field_name = None
         #QUESTION: When does this occur?
         #ANSWER: This is used when one of the file handler on line 257 signals to
         #stop any more further file handline. This means any further file upload
@@ -302,10 +338,10 @@ class MultiPartParser:
         except StopUpload as e:
             self._close_files()
             if not e.connection_reset:
-                exhaust(self._input_data)
+                self._exhaust_input(input_start)
         else:
             # Make sure that the request data is all fed
-            exhaust(self._input_data)
+            self._exhaust_input(input_start)
 
         # Signal that the upload has completed.
         # any() shortcircuits if a handler's upload_complete() returns a value.
@@ -315,6 +351,158 @@ class MultiPartParser:
         self._post._mutable = False
         return self._post, self._files
 
+    def _parts(self):
+        """
+        Return the item_type, meta_data, field_stream iterable of the parts
+        of the body, parts nested in multipart parts included.
+        """
+        return self._expand_nested(self._body_parts())
+
+    def _body_parts(self):
+        """
+        Return the item_type, meta_data, field_stream iterable of the parts
+        of the body: a BufferParser for bodies up to settings.MULTIPART_BUFFER_MAX_SIZE,
+        the parser of settings.MULTIPART_ENGINE otherwise.
+        """
+        buffer_max_size = self.settings.MULTIPART_BUFFER_MAX_SIZE
+        if buffer_max_size is not None and self._content_length <= buffer_max_size and\
+            hasattr(self._input_data, 'read'):
+            # Small bodies are read at once and split in memory.
+            body = self._input_data.read(self._content_length)
+            return BufferParser(body, self._boundary, self.settings.MAX_PART_HEADER_SIZE)
+        if self.settings.MULTIPART_ENGINE == 'flat':
+            stream = ChunkIter(self._input_data, self._chunk_size)
+            return FlatParser(stream, self._boundary, self.settings.MAX_PART_HEADER_SIZE,
+                              self.settings.TRUST_PART_CONTENT_LENGTH)
+        # Instantiate the stream:
+        stream = LazyStream(ChunkIter(self._input_data, self._chunk_size))
+        return Parser(stream, self._boundary, self.settings.MAX_PART_HEADER_SIZE)
+
+    def _expand_nested(self, parts, depth=0):
+        """
+        Yield the parts of parts, replacing each part that is itself a
+        multipart body (multipart/mixed files of a field, a multipart/related
+        SOAP message...) by the parts nested in it.
+
+        The nested parts are scanned by a FlatParser straight from the outer
+        part's stream, they take the name of the outer part. An outer part
+        the selected fields leave out is yielded as it is, to be skipped
+        without its nested parts being scanned.
+        """
+        for item_type, meta_data, field_stream in parts:
+            content_type, content_type_extra = meta_data.get('content-type', ('', {}))
+            boundary = content_type_extra.get('boundary')
+            if depth >= MAX_NESTING_DEPTH or not content_type.strip().lower().startswith('multipart/') or\
+                not boundary or not cgi.valid_boundary(boundary):
+                yield item_type, meta_data, field_stream
+                continue
+
+            try:
+                field_name = meta_data['content-disposition'][1]['name']
+            except (KeyError, IndexError, AttributeError):
+                exhaust(field_stream)
+                continue
+
+            if self._select is not None and not self._select(field_name.strip(), meta_data):
+                yield item_type, meta_data, field_stream
+                continue
+
+            nested_parts = FlatParser(field_stream, boundary, self.settings.MAX_PART_HEADER_SIZE, yield_raw=True)
+            nested_parts = self._name_nested(nested_parts, field_name)
+            for nested_part in self._expand_nested(nested_parts, depth + 1):
+                yield nested_part
+            # Skip the epilogue of the nested body.
+            exhaust(field_stream)
+
+    def _name_nested(self, nested_parts, field_name):
+        """
+        Give the parts nested in the field field_name the form-data
+        Content-Disposition the parser expects: they're files if they have a
+        filename (or a Content-ID, as multipart/related parts do), fields otherwise.
+        """
+        for item_type, meta_data, field_stream in nested_parts:
+            disposition = meta_data.get('content-disposition', ('', {}))[1]
+            file_name = disposition.get('filename')
+            if not file_name and 'content-id' in meta_data:
+                file_name = meta_data['content-id'][0].strip().strip('<>')
+
+            params = {'name' : field_name}
+            if file_name:
+                params['filename'] = file_name
+            meta_data = dict(meta_data)
+            meta_data['content-disposition'] = ('form-data', params)
+            yield (FILE if file_name else FIELD), meta_data, field_stream
+
+    def iter_parts(self):
+        """
+        Yield a Part for each field or file of the body as it is reached.
+
+        Nothing is stored and the upload handlers aren't called: the caller
+        reads (or doesn't read) each part's payload before asking for the
+        next one, what's left unread of a part is skipped.
+        """
+        if self._content_length == 0:
+            return
+
+        # To count the number of keys in the request.
+        num_post_keys = 0
+
+        input_start = self._input_position()
+        for item_type, meta_data, field_stream in self._parts():
+            try:
+                disposition = meta_data['content-disposition'][1]
+                field_name = disposition['name'].strip()
+            except (KeyError, IndexError, AttributeError):
+                exhaust(field_stream)
+                continue
+
+            # The skipped parts and the fields count towards
+            # DATA_UPLOAD_MAX_NUMBER_FIELDS, as in parse().
+            skipped = self._select is not None and not self._select(field_name, meta_data)
+            if skipped or item_type == FIELD:
+                num_post_keys += 1
+                if (self.settings.DATA_UPLOAD_MAX_NUMBER_FIELDS is not None and
+                        self.settings.DATA_UPLOAD_MAX_NUMBER_FIELDS < num_post_keys):
+                    raise TooManyFieldsSent(
+                        'The number of GET/POST parameters exceeded '
+                        'settings.DATA_UPLOAD_MAX_NUMBER_FIELDS.'
+                    )
+
+            if skipped:
+                exhaust(field_stream)
+                continue
+
+            part = Part(item_type, meta_data, field_stream, self._encoding)
+            if item_type == FILE:
+                part.filename = self.IE_sanitize(unescape_entities(part.filename))
+            yield part
+            #whatever the caller didn't read of the part is skipped
+            exhaust(field_stream)
+
+        # Make sure that the request data is all fed
+        self._exhaust_input(input_start)
+
+    def _input_position(self):
+        """
+        Return the position of the input data, None if it can't tell.
+        """
+        try:
+            return self._input_data.tell()
+        except (AttributeError, IOError, OSError):
+            return None
+
+    def _exhaust_input(self, input_start):
+        """
+        Skip what's left of the body in the input data. If the position the
+        body started at (input_start) is known, no more than Content-Length
+        bytes are skipped from there.
+        """
+        size = None
+        input_position = self._input_position()
+        if input_start is not None and input_position is not None:
+            size = max(0, self._content_length - (input_position - input_start))
+        exhaust(self._input_data, size)
+
     def handle_file_complete(self, old_field_name, counters):
         """
         Handle all the signaling that takes place when a file is complete.
@@ -325,6 +513,24 @@ class MultiPartParser:
                 # If it returns a file object, then set the files dict.
                 self._files.appendlist(force_text(old_field_name, self._encoding, errors='replace'), file_obj)
                 break
+        #the files of the handlers now belong to FILES, unless file_complete()
+        #failed and they're freed with the others
+        self._file_handlers = []
+
+    def _interrupt_upload(self):
+        """
+        Clean up after an error stopped parse(): the handlers are told the
+        upload was interrupted and the files received so far, which the caller
+        never gets, are closed.
+        """
+        self._close_files()
+        for handler in self._upload_handlers:
+            handler.upload_interrupted()
+        files = getattr(self, '_files', None)
+        if files is not None:
+            for file_list in files.lists():
+                for file_obj in file_list[1]:
+                    file_obj.close()
 
     #What the hell is this for?
     def IE_sanitize(self, filename):
@@ -332,12 +538,188 @@ class MultiPartParser:
         return filename and filename[filename.rfind("\\") + 1:].strip()
 
     def _close_files(self):
-        # Free up all file handles.
-        # FIXME: this currently assumes that upload handlers store the file as 'file'
-        # We should document that... (Maybe add handler.free_file to complement new_file)
-        for handler in self._upload_handlers:
-            if hasattr(handler, 'file'):
-                handler.file.close()
+        # Free up the file handles of the file being received.
+        #the files of the handlers that didn't start it are complete files in
+        #FILES (or nothing), they're left open
+        for handler in self._file_handlers:
+            handler.free_file()
+        self._file_handlers = []
+
+class FieldValue(object):
+    """
+    Value of a multipart field in POST.
+
+    Behaves like the read-only dictionary
+    {'data': ..., 'content-type': ..., 'transfer-encoding': ..., 'content-type-extra': {}}
+    and compares equal to it, but holds the values in slots, decodes the data
+    and the content type only when they're first accessed and doesn't keep
+    an empty content-type-extra dictionary around.
+    """
+    __slots__ = ('_data', '_content_type', 'transfer_encoding', '_content_type_extra', '_encoding')
+
+    KEYS = ('data', 'content-type', 'transfer-encoding', 'content-type-extra')
+
+    def __init__(self, data, content_type, transfer_encoding, content_type_extra, encoding):
+        self._data = data
+        self._content_type = content_type
+        self.transfer_encoding = transfer_encoding
+        self._content_type_extra = content_type_extra or None
+        #None once data and content_type are decoded
+        self._encoding = encoding
+
+    def _decode(self):
+        if self._encoding is not None:
+            self._data = force_text(self._data, self._encoding, errors='replace')
+            self._content_type = force_text(self._content_type, self._encoding, errors='replace')
+            self._encoding = None
+
+    @property
+    def data(self):
+        self._decode()
+        return self._data
+
+    @property
+    def content_type(self):
+        self._decode()
+        return self._content_type
+
+    @property
+    def content_type_extra(self):
+        if self._content_type_extra is None:
+            return {}
+        return self._content_type_extra
+
+    def __getitem__(self, key):
+        if key == 'data':
+            return self.data
+        elif key == 'content-type':
+            return self.content_type
+        elif key == 'transfer-encoding':
+            return self.transfer_encoding
+        elif key == 'content-type-extra':
+            return self.content_type_extra
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in FieldValue.KEYS
+
+    def __iter__(self):
+        return iter(FieldValue.KEYS)
+
+    def __len__(self):
+        return len(FieldValue.KEYS)
+
+    def keys(self):
+        return list(FieldValue.KEYS)
+
+    def values(self):
+        return [self[key] for key in FieldValue.KEYS]
+
+    def items(self):
+        return [(key, self[key]) for key in FieldValue.KEYS]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (FieldValue, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in FieldValue.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(FieldValue.__slots__, state):
+            setattr(self, slot, value)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+class Part:
+    """
+    A field or a file of a multipart body, as yielded by MultiPartParser.iter_parts().
+
+    The headers are parsed and the payload is read from the body on demand
+    with read() or by iterating over the part, decoded from its
+    Content-Transfer-Encoding. The payload can only be read until the next
+    part is asked for.
+    """
+    def __init__(self, item_type, meta_data, field_stream, encoding):
+        #lowercased header name -> (value, params)
+        self.headers = meta_data
+        self.is_file = item_type == FILE
+
+        disposition = meta_data['content-disposition'][1]
+        self.name = force_text(disposition['name'].strip(), encoding, errors='replace')
+        self.filename = None
+        if self.is_file:
+            self.filename = force_text(disposition.get('filename', ''), encoding, errors='replace')
+
+        content_type, self.content_type_extra = meta_data.get('content-type', ('', {}))
+        self.content_type = force_text(content_type.strip(), encoding, errors='replace')
+        self.charset = self.content_type_extra.get('charset')
+
+        transfer_encoding = meta_data.get('content-transfer-encoding')
+        if transfer_encoding is not None:
+            transfer_encoding = force_text(transfer_encoding[0].strip(), encoding, errors='replace')
+        self.transfer_encoding = transfer_encoding
+
+        self._chunks = iter(field_stream)
+        decoder = get_transfer_decoder(transfer_encoding)
+        if decoder is not None:
+            self._chunks = decoder.decode_iter(self._chunks)
+        self._leftover = b''
+
+    def __repr__(self):
+        return "<%s: %s (%s)>" % (self.__class__.__name__, self.name, self.content_type)
+
+    def __iter__(self):
+        return self
+
+    #def __next__(self):
+    def next(self):
+        """
+        Return the next chunk of the payload, whatever its size.
+        """
+        if self._leftover:
+            output = self._leftover
+            self._leftover = b''
+            return output
+        return next(self._chunks)
+
+    def read(self, size=None):
+        """
+        Read up to size bytes of the payload, all of it if size is None.
+        Return b'' once the payload is exhausted.
+        """
+        chunks = []
+        remaining = size
+        while remaining is None or remaining > 0:
+            try:
+                chunk = next(self)
+            except StopIteration:
+                break
+            if remaining is not None:
+                self._leftover = chunk[remaining:]
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
 
 class InterBoundaryIter:
     """
@@ -371,6 +753,12 @@ class BoundaryIter:
     before the boundary, throw away the boundary bytes themselves, and push the
     post-boundary bytes back on the stream.
 
+    Each chunk pulled from the stream is searched for the boundary once. Only
+    the few trailing bytes of a chunk that could be the beginning of a boundary
+    split across two chunks (and the CRLF preceding it) are carried over to the
+    next call; everything else is yielded as is, without being joined or put
+    back on the stream.
+
     The future calls to next() after locating the boundary will raise a
     StopIteration exception.
     """
@@ -379,12 +767,13 @@ class BoundaryIter:
         self._stream = stream
         self._boundary = boundary
         self._done = False
-        # rollback an additional six bytes because the format is like
-        # this: CRLF<boundary>[--CRLF]
-        self._rollback = len(boundary) + 6
+        #bytes held back from the previous chunk
+        self._carry = b''
+        #a boundary split across chunks is preceded by CRLF and
+        #at most len(boundary) - 1 of its bytes are in the first chunk
+        self._carry_size = len(boundary) + 1
+        self._prefixes = (b'\r\n' + boundary, b'\n' + boundary, boundary)
 
-        # Try to use mx fast string search if available. Otherwise
-        # use Python find. Wrap the latter for consistency.
         unused_char = self._stream.read(1)
         #peek if stream is empty
         if not unused_char:
@@ -401,52 +790,56 @@ class BoundaryIter:
             raise StopIteration()
 
         stream = self._stream
-        rollback = self._rollback
-
-        bytes_read = 0
-        chunks = []
-        for bytes in stream:
-            bytes_read += len(bytes)
-            chunks.append(bytes)
-
-            if bytes_read > rollback:
-                break
-            if not bytes:
-                break
-        else:
-            self._done = True
+        while True:
+            try:
+                chunk = next(stream)
+            except StopIteration:
+                #no more boundaries, whatever was held back is data
+                self._done = True
+                chunk, self._carry = self._carry, b''
+                if not chunk:
+                    raise StopIteration()
+                return chunk
 
-        if not chunks:
-            raise StopIteration()
+            if self._carry:
+                chunk = self._carry + chunk
+                self._carry = b''
+
+            boundary = self._find_boundary(chunk)
+            if boundary:
+                #get the indices of current inter-boundary data - end
+                #get the beginning of the next inter-boundary data - next_start
+                end, next_start = boundary
+                #put back everything starting from next_start till end of POST back in the stream
+                stream.unget(chunk[next_start:])
+                #done with current inter-boundary data
+                self._done = True
+                #return everything from beginning to end
+                return chunk[:end]
 
-        #convert the byte array into one contiguous set of bytes (or string)
-        chunk = b''.join(chunks)
-        boundary = self._find_boundary(chunk)
-
-        if boundary:
-            #get the indices of current inter-boundary data - end
-            #get the beginning of the next inter-boundary data - next
-            end, next = boundary
-            #put back everything starting from next till end of POST back in the stream
-            stream.unget(chunk[next:])
-            #done with current inter-boundary data
-            self._done = True
-            #return everything from beginning to end
-            return chunk[:end]
-        #If no boundary is found
-        else:
             # make sure we don't treat a partial boundary (and
             # its separators) as data
-
-            #if there's no data from beginning to end - 6
-            if not chunk[:-rollback]:  # and len(chunk) >= (len(self._boundary) + 6):
-                # There's nothing left, we should just return and mark as done.
-                self._done = True
+            carry_size = self._partial_boundary_size(chunk)
+            if carry_size:
+                self._carry = chunk[-carry_size:]
+                chunk = chunk[:-carry_size]
+            if chunk:
                 return chunk
-            #if there is data, then put it back and return
-            else:
-                stream.unget(chunk[-rollback:])
-                return chunk[:-rollback]
+
+    def _partial_boundary_size(self, data):
+        """
+        Return the length of the longest suffix of data that may be the
+        beginning of a boundary, including the CRLF before it, or 0.
+        """
+        length = len(data)
+        for start in range(max(0, length - self._carry_size), length):
+            if data[start:start + 1] not in b'\r\n-':
+                continue
+            suffix = data[start:]
+            for prefix in self._prefixes:
+                if prefix.startswith(suffix):
+                    return length - start
+        return 0
 
     def _find_boundary(self, data):
         """
@@ -472,14 +865,109 @@ class BoundaryIter:
                 end -= 1
             return end, next
 
-def exhaust(stream_or_iterable):
-    """Exhaust an iterator or stream."""
-    try:
-        iterator = iter(stream_or_iterable)
-    except TypeError:
-        iterator = ChunkIter(stream_or_iterable, 16384)
+class TransferDecoder:
+    """
+    Decode a part's Content-Transfer-Encoding from chunks of arbitrary size.
+
+    Bytes that can't be decoded on their own (a partial base64 quantum, a
+    split quoted-printable escape) are carried over to the next chunk.
+    """
+    def __init__(self):
+        self._pending = b''
 
-    for __ in iterator:
+    def decode(self, chunk):
+        """
+        Return the decoded bytes of chunk, keeping back the incomplete tail.
+        """
+        raise NotImplementedError()
+
+    def flush(self):
+        """
+        Return whatever is left to decode at the end of the part.
+        """
+        raise NotImplementedError()
+
+    def decode_iter(self, stream):
+        """
+        Yield the decoded chunks of stream.
+        """
+        for chunk in stream:
+            chunk = self.decode(chunk)
+            if chunk:
+                yield chunk
+        chunk = self.flush()
+        if chunk:
+            yield chunk
+
+class Base64Decoder(TransferDecoder):
+    """
+    Decode base64, ignoring whitespace, by multiples of 4 bytes.
+    """
+    def decode(self, chunk):
+        #strip whitespace in one pass
+        data = self._pending + chunk.translate(None, b' \t\r\n\x0b\x0c')
+        end = len(data) - len(data) % 4
+        self._pending = data[end:]
+        try:
+            return base64.b64decode(data[:end])
+        except Exception as exc:
+            # Since this is only a chunk, any error is an unfixable error.
+            raise_from(MultiPartParserError("Could not decode base64 data."), exc)
+
+    def flush(self):
+        if self._pending:
+            #a truncated part can't be realigned
+            raise MultiPartParserError("Could not decode base64 data.")
+        return b''
+
+class QuotedPrintableDecoder(TransferDecoder):
+    """
+    Decode quoted-printable, keeping back escapes and soft line breaks
+    ('=XX', '=\\r\\n') split between chunks.
+    """
+    def decode(self, chunk):
+        data = self._pending + chunk
+        #an '=' in the last 3 bytes might not be complete yet
+        end = data.rfind(b'=', max(0, len(data) - 3))
+        if end == -1:
+            end = len(data)
+        self._pending = data[end:]
+        return binascii.a2b_qp(data[:end])
+
+    def flush(self):
+        data = self._pending
+        self._pending = b''
+        return binascii.a2b_qp(data)
+
+TRANSFER_DECODERS = {
+    'base64' : Base64Decoder,
+    'quoted-printable' : QuotedPrintableDecoder,
+}
+
+def get_transfer_decoder(transfer_encoding):
+    """
+    Return a new TransferDecoder for transfer_encoding, None if the
+    part doesn't need decoding (7bit, 8bit, binary or no encoding).
+    """
+    if not transfer_encoding:
+        return None
+    decoder_class = TRANSFER_DECODERS.get(transfer_encoding.lower())
+    if decoder_class is None:
+        return None
+    return decoder_class()
+
+def exhaust(stream_or_iterable, size=None):
+    """
+    Exhaust an iterator or stream.
+
+    Streams (and file-like objects) are skipped without reading their
+    content when possible, at most size bytes of them if size isn't None.
+    """
+    if hasattr(stream_or_iterable, 'skip') or hasattr(stream_or_iterable, 'read'):
+        skip_file(stream_or_iterable, size)
+        return
+
+    for __ in stream_or_iterable:
         pass
 
 def parse_boundary_stream(stream, max_header_size):
@@ -487,15 +975,50 @@ def parse_boundary_stream(stream, max_header_size):
     Parse one and exactly one stream that's encpasulated within a boundary.
     """
     # Stream at beginning of header, look for end of header
-    # and parse it if found. The header must fit within one
-    # chunk.
-    chunk = stream.read(max_header_size)
+    # and parse it if found. Only the chunks needed to find the
+    # end of the header are pulled from the stream and the header
+    # must fit within max_header_size bytes.
+    chunk = b''
+    header_end = -1
+    for piece in stream:
+        # the CRLFCRLF might straddle the previous and the current piece
+        search_start = max(0, len(chunk) - 3)
+        chunk += piece
+        # 'find' returns the top of these four bytes, so we'll
+        # need to munch them later to prevent them from polluting
+        # the payload.
+        header_end = chunk.find(b'\r\n\r\n', search_start)
+        if header_end != -1 or len(chunk) > max_header_size:
+            break
+
+    if header_end == -1 or header_end > max_header_size:
+        # we find no header, so we just mark this fact and pass on
+        # the stream verbatim
+        stream.unget(chunk)
+        return (RAW, {}, stream)
+
+    header = chunk[:header_end]
+
+    TYPE, outdict = parse_part_header(header)
+
+    #if the stream if raw, then put it back
+    #into the stream for it to be read byt the main parser
+    if TYPE == RAW:
+        stream.unget(chunk)
+    else:
+        # here we place any excess chunk back onto the stream, as
+        # well as throwing away the CRLFCRLF bytes from above.
+        stream.unget(chunk[header_end + 4:])
 
-    # 'find' returns the top of these four bytes, so we'll
-    # need to munch them later to prevent them from polluting
-    # the payload.
-    header_end = chunk.find(b'\r\n\r\n')
+    return (TYPE, outdict, stream)
 
+def parse_part_header(header):
+    """
+    Parse the header lines of a part.
+
+    Return the part's type (RAW, FIELD or FILE) and a dictionary of
+    header name to (value, params).
+    """
     def _parse_header(line):
         main_value_pair, params = parse_header(line)
         try:
@@ -504,18 +1027,6 @@ def parse_boundary_stream(stream, max_header_size):
             raise ValueError("Invalid header: %r" % line)
         return name, (value, params)
 
-    if header_end == -1:
-        # we find no header, so we just mark this fact and pass on
-        # the stream verbatim
-        stream.unget(chunk)
-        return (RAW, {}, stream)
-
-    header = chunk[:header_end]
-
-    # here we place any excess chunk back onto the stream, as
-    # well as throwing away the CRLFCRLF bytes from above.
-    stream.unget(chunk[header_end + 4:])
-
     TYPE = RAW
     outdict = {}
 
@@ -535,23 +1046,19 @@ def parse_boundary_stream(stream, max_header_size):
 
         outdict[name] = value, params
 
-    #if the stream if raw, then put it back
-    #into the stream for it to be read byt the main parser
-    if TYPE == RAW:
-        stream.unget(chunk)
-
-    return (TYPE, outdict, stream)
+    return TYPE, outdict
 
 class Parser:
     """
     Parser class that parses inter-boudary data to return,
     item_type, meta_data, field_stream.
     """
-    def __init__(self, stream, boundary):
+    def __init__(self, stream, boundary, max_header_size=1024):
         self._stream = stream
         #the actual boundary in the HTTP header is '--' shorter than the
         #separating boundary in the POST body
         self._separator = b'--' + boundary
+        self._max_header_size = max_header_size
 
     def __iter__(self):
         boundarystream = InterBoundaryIter(self._stream, self._separator)
@@ -561,7 +1068,328 @@ class Parser:
         for sub_stream in boundarystream:
             # Iterate over each part
             #to return item_type, meta_data, field_stream
-            yield parse_boundary_stream(sub_stream, 1024)
+            yield parse_boundary_stream(sub_stream, self._max_header_size)
+
+class FlatParser:
+    """
+    Alternative to Parser that walks the body with one flat state machine
+    (preamble, part headers, part body, epilogue) over a single buffer.
+
+    Yields the same item_type, meta_data, field_stream tuples as Parser, but
+    without creating a LazyStream, a BoundaryIter and an InterBoundaryIter
+    per part or ungetting bytes between them. Parts without a header (RAW)
+    are skipped since MultiPartParser ignores them anyway.
+
+    Selected with settings.MULTIPART_ENGINE = 'flat'.
+
+    With trust_content_length, the body of a part that declares its
+    Content-Length is read as that many bytes without looking for the
+    boundary in it, and the boundary is then checked to follow.
+    """
+    PREAMBLE = 0
+    DELIMITER = 1
+    HEADERS = 2
+    BODY = 3
+    EPILOGUE = 4
+
+    def __init__(self, producer, boundary, max_header_size=1024, trust_content_length=False, yield_raw=False):
+        """
+        producer - An iterable that yields chunks of the body, a ChunkIter for instance.
+        yield_raw - Whether to yield the parts without a Content-Disposition (RAW)
+                    instead of skipping them.
+        """
+        self._producer = iter(producer)
+        self._separator = b'--' + boundary
+        self._max_header_size = max_header_size
+        self._trust_content_length = trust_content_length
+        self._yield_raw = yield_raw
+        #bytes left of the body of the current part if it declared its Content-Length
+        self._part_remaining = None
+        #bytes of the body that might be followed by a separator are held back
+        #until we know whether they're data or the CRLF before the separator
+        self._hold_back = len(self._separator) + 1
+        self._buffer = b''
+        self._position = 0
+        self._eof = False
+        self._state = FlatParser.PREAMBLE
+
+    def _fill(self):
+        """
+        Append the next chunk of the body to the buffer, dropping what has
+        already been consumed. Return False at the end of the body.
+        """
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._producer)
+        except StopIteration:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+    def __iter__(self):
+        while True:
+            if self._state == FlatParser.PREAMBLE:
+                index = self._buffer.find(self._separator, self._position)
+                if index == -1:
+                    #keep what could be the beginning of the separator
+                    self._position = max(self._position, len(self._buffer) - len(self._separator) + 1)
+                    if not self._fill():
+                        return
+                    continue
+                self._position = index + len(self._separator)
+                self._state = FlatParser.DELIMITER
+
+            elif self._state == FlatParser.DELIMITER:
+                #number of bytes of the part already scanned for the end of its header
+                scanned = 0
+                if len(self._buffer) - self._position < 2 and self._fill():
+                    continue
+                #the close delimiter '--<boundary>--' ends the body
+                if self._buffer[self._position:self._position + 2] == b'--' or\
+                    self._position == len(self._buffer):
+                    self._state = FlatParser.EPILOGUE
+                else:
+                    self._state = FlatParser.HEADERS
+
+            elif self._state == FlatParser.HEADERS:
+                #don't rescan what was scanned before the last _fill()
+                header_end = self._buffer.find(b'\r\n\r\n', self._position + max(0, scanned - 3))
+                if header_end == -1 or header_end - self._position > self._max_header_size:
+                    scanned = len(self._buffer) - self._position
+                    if scanned <= self._max_header_size and self._fill():
+                        continue
+                    #no header, skip the part
+                    self._state = FlatParser.BODY
+                    exhaust(FlatPartStream(self))
+                    continue
+
+                header = self._buffer[self._position:header_end]
+                #the header can't extend over the next part
+                if header.find(self._separator) != -1:
+                    self._state = FlatParser.BODY
+                    exhaust(FlatPartStream(self))
+                    continue
+
+                item_type, meta_data = parse_part_header(header)
+                self._position = header_end + 4
+                self._state = FlatParser.BODY
+                if self._trust_content_length:
+                    self._part_remaining = declared_content_length(meta_data)
+                if item_type == RAW and not self._yield_raw:
+                    exhaust(FlatPartStream(self))
+                    continue
+
+                part_stream = FlatPartStream(self)
+                yield item_type, meta_data, part_stream
+                #whatever the consumer didn't read of the part is skipped
+                exhaust(part_stream)
+
+            else:
+                return
+
+    def read_part(self, size=None):
+        """
+        Return up to size bytes (as many as are buffered if size is None) of
+        the current part's body, b'' once the part is over.
+        """
+        if self._part_remaining is not None:
+            return self._read_declared_part(size)
+
+        while self._state == FlatParser.BODY:
+            buffer = self._buffer
+            start = self._position
+            index = buffer.find(self._separator, start)
+            if index != -1:
+                end = index
+                # backup over CRLF
+                if end > start and buffer[end - 1:end] == b'\n':
+                    end -= 1
+                if end > start and buffer[end - 1:end] == b'\r':
+                    end -= 1
+                if size is not None and end - start > size:
+                    self._position = start + size
+                    return buffer[start:start + size]
+                self._position = index + len(self._separator)
+                self._state = FlatParser.DELIMITER
+                return buffer[start:end]
+
+            if self._eof:
+                end = len(buffer)
+                if size is None or end - start <= size:
+                    self._state = FlatParser.EPILOGUE
+            else:
+                end = len(buffer) - self._hold_back
+            if size is not None:
+                end = min(end, start + size)
+            if end > start:
+                self._position = end
+                return buffer[start:end]
+            self._fill()
+        return b''
+
+    def _read_declared_part(self, size=None):
+        """
+        read_part() for a part whose body is as long as its declared Content-Length.
+        """
+        while self._part_remaining:
+            available = len(self._buffer) - self._position
+            if not available:
+                if not self._fill():
+                    raise MultiPartParserError("Multipart part is shorter than its Content-Length.")
+                continue
+            count = min(available, self._part_remaining)
+            if size is not None:
+                count = min(count, size)
+            start = self._position
+            self._position += count
+            self._part_remaining -= count
+            return self._buffer[start:self._position]
+
+        #the boundary must follow the body right away (a bare LF in front of
+        #it isn't accepted here since it could also be the end of the body)
+        delimiter_size = len(self._separator) + 2
+        while len(self._buffer) - self._position < delimiter_size and self._fill():
+            pass
+        if self._buffer[self._position:self._position + delimiter_size] == b'\r\n' + self._separator:
+            self._position += delimiter_size
+        else:
+            raise MultiPartParserError("Multipart part isn't followed by the boundary after its Content-Length.")
+        self._part_remaining = None
+        self._state = FlatParser.DELIMITER
+        return b''
+
+class BufferParser:
+    """
+    Parser for a multipart body held entirely in memory.
+
+    Splits the body with find() over the whole buffer and yields the same
+    item_type, meta_data, field_stream tuples as Parser where each
+    field_stream hands out the part's body as a single slice. Parts without
+    a header (RAW) are skipped like FlatParser does.
+    """
+    def __init__(self, buffer, boundary, max_header_size=1024):
+        self._buffer = buffer
+        self._separator = b'--' + boundary
+        self._max_header_size = max_header_size
+
+    def __iter__(self):
+        buffer = self._buffer
+        separator = self._separator
+        index = buffer.find(separator)
+        while index != -1:
+            start = index + len(separator)
+            #the close delimiter '--<boundary>--' ends the body
+            if buffer[start:start + 2] == b'--' or start == len(buffer):
+                return
+
+            index = buffer.find(separator, start)
+            if index == -1:
+                #no boundary after the part, it goes on to the end of the body
+                end = len(buffer)
+            else:
+                end = index
+                # backup over CRLF
+                if buffer[end - 1:end] == b'\n':
+                    end -= 1
+                if buffer[end - 1:end] == b'\r':
+                    end -= 1
+
+            header_end = buffer.find(b'\r\n\r\n', start, end)
+            if header_end == -1 or header_end - start > self._max_header_size:
+                continue
+            item_type, meta_data = parse_part_header(buffer[start:header_end])
+            if item_type == RAW:
+                continue
+            yield item_type, meta_data, BufferPartStream(buffer[header_end + 4:end])
+
+class BufferPartStream:
+    """
+    The body of a part parsed by BufferParser.
+
+    Supports iteration over chunks (there's only one) and read() like the
+    LazyStream handed out by Parser.
+    """
+    def __init__(self, data):
+        self._data = data
+
+    def __iter__(self):
+        return self
+
+    #def __next__(self):
+    def next(self):
+        data = self.read()
+        if not data:
+            raise StopIteration()
+        return data
+
+    def read(self, size=None):
+        data = self._data
+        if size is not None and size < len(data):
+            self._data = data[size:]
+            return data[:size]
+        self._data = b''
+        return data
+
+    def skip(self, size=None):
+        skipped = len(self.read(size))
+        return skipped
+
+def declared_content_length(meta_data):
+    """
+    Return the Content-Length declared in the headers of a part as an int,
+    None if there's no valid one.
+    """
+    try:
+        content_length = int(meta_data.get('content-length')[0])
+    except (IndexError, TypeError, ValueError):
+        return None
+    if content_length < 0:
+        return None
+    return content_length
+
+class FlatPartStream:
+    """
+    The body of the current part of a FlatParser.
+
+    Supports iteration over chunks and read() like the LazyStream handed out
+    by Parser.
+    """
+    def __init__(self, parser):
+        self._parser = parser
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    #def __next__(self):
+    def next(self):
+        chunk = self.read_chunk()
+        if not chunk:
+            raise StopIteration()
+        return chunk
+
+    def read_chunk(self, size=None):
+        if self._done:
+            return b''
+        chunk = self._parser.read_part(size)
+        if not chunk:
+            self._done = True
+        return chunk
+
+    def read(self, size=None):
+        chunks = []
+        remaining = size
+        while remaining is None or remaining > 0:
+            chunk = self.read_chunk(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+        return b''.join(chunks)
 
 def parse_header(line):
     """
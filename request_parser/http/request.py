@@ -3,6 +3,7 @@ import re
 import warnings
 from io import BytesIO
 from itertools import chain
+from tempfile import SpooledTemporaryFile
 #from urllib.parse import quote, urlencode, urljoin, urlsplit
 from urllib import quote, urlencode
     #urljoin, urlsplit
@@ -11,7 +12,7 @@ from request_parser.conf.settings import Settings
 from request_parser.exceptions.exceptions import RequestDataTooBig
 from request_parser.files import uploadhandler
 from request_parser.http.multipartparser import MultiPartParser, MultiPartParserError, parse_header, LazyStream
-from request_parser.utils.datastructures import ImmutableList, MultiValueDict, ImmutableMultiValueDict
+from request_parser.utils.datastructures import ImmutableList, MultiValueDict, ImmutableMultiValueDict, ChunkIter
 from request_parser.utils.encoding import escape_uri_path, iri_to_uri, uri_to_iri
 from request_parser.utils.http import is_same_domain, limited_parse_qsl, _urlparse as urlparse
 from constants import MetaDict
@@ -79,9 +80,32 @@ class HttpRequest(object,):
         #                 'transfer-encoding' : val,
         #                 'content-type-extra': {}
         #               }
+        # (a multipartparser.FieldValue that behaves like this dictionary)
         self.POST = QueryDict(self.settings, mutable=True)
         self.FILES = MultiValueDict()
 
+        #state used by feed() when the request is pushed to us by an
+        #event loop instead of being pulled from request_stream
+        self._feed_buffer = b''
+        self._feed_body = None
+        self._feed_body_size = 0
+        self._feed_content_length = None
+        #bytes received after the declared Content-Length of the body
+        #(a pipelined request for instance)
+        self.trailing_data = b''
+
+        #names of the multipart/form-data parts to parse (or a callable that
+        #takes the part's name and headers and returns whether to parse it),
+        #other parts are skipped. None parses all of them.
+        self.multipart_fields = None
+
+        #UploadPolicyViolation of the files rejected by PolicyFileUploadHandler
+        self.upload_policy_violations = []
+
+        #upload handlers and the registry they come from, if any
+        self._upload_handlers = []
+        self._handler_registry = None
+
         self._re_init()
 
     def _re_init(self):
@@ -104,6 +128,10 @@ class HttpRequest(object,):
         self.content_type = None
         self.content_params = None
 
+        #Expect: 100-continue handshake status
+        self._continue_sent = False
+        self.body_rejected = False
+
     def __repr__(self):
         if self.method is None or not self.get_full_path():
             return '<%s>' % self.__class__.__name__
@@ -200,7 +228,8 @@ class HttpRequest(object,):
         #DONE: Need to check when the GET/POST dictonary is redone?
         #ANSWER: They're redone whenever parse_request_header and parse_request_body
         #are called
-        self.settings.DEFAULT_CHARSET = val
+        #the settings can be shared (and frozen), change a copy
+        self.settings = self.settings.overlay(DEFAULT_CHARSET=val)
         if hasattr(self, 'GET'):
             del self.GET
         if hasattr(self, '_post'):
@@ -273,6 +302,7 @@ class HttpRequest(object,):
 
         #reset the body parsing flag
         self._request_body_parsed = False
+        self.body_rejected = False
 
     def _reset_header_meta_data(self):
         """
@@ -324,8 +354,18 @@ class HttpRequest(object,):
         Set the _upload_handlers to an array of upload handlers loaded from
         settings.FILE_UPLOAD_HANDLERS
         """
-        self._upload_handlers = [uploadhandler.load_handler(handler, self)
-                                 for handler in self.settings.FILE_UPLOAD_HANDLERS]
+        #the handler classes are imported once per process
+        self._handler_registry = uploadhandler.get_handler_registry(self.settings)
+        self._upload_handlers = self._handler_registry.handlers(self)
+
+    def _release_handlers(self):
+        """
+        Give the upload handlers back to their registry once the body is parsed.
+        """
+        if self._handler_registry is not None:
+            self._handler_registry.release(self._upload_handlers)
+            self._handler_registry = None
+            self._upload_handlers = []
 
     @property
     def upload_handlers(self):
@@ -338,21 +378,251 @@ class HttpRequest(object,):
     def upload_handlers(self, upload_handlers):
         if hasattr(self, '_files'):
             raise AttributeError("You cannot set the upload handlers after the upload has been processed.")
+        self._handler_registry = None
         self._upload_handlers = upload_handlers
 
-    def parse(self):
+    def parse(self, expect_continue=None):
         """
         Entry point for the parsing a whole HTTP Request.
 
         Accepts a stream that represents the request_stream
+
+        expect_continue - Callable that's called with this request once the request
+        header is parsed if the client sent 'Expect: 100-continue'. It can inspect the
+        headers and then call either send_continue() or reject_body().
         """
         self.parse_request_header()
+        if expect_continue is not None and self.expects_continue():
+            expect_continue(self)
         self.parse_request_body()
 
+    def expects_continue(self):
+        """
+        Return True if the client waits for a '100 Continue' response before sending the body.
+        """
+        if not self._request_header_parsed or self.protocol_info == 'HTTP/1.0':
+            return False
+        request_headers = self.META.get(MetaDict.Info.REQ_HEADERS, {})
+        expect = request_headers.get('Expect')
+        return expect is not None and expect.strip().lower() == '100-continue'
+
+    def send_continue(self, write):
+        """
+        Let a client that sent 'Expect: 100-continue' transmit the request body.
+
+        write - Callable that writes the given bytes to the transport.
+
+        Return True if the interim response was written, False if the client didn't ask
+        for it or it has already been sent.
+        """
+        if self._continue_sent or self.body_rejected or not self.expects_continue():
+            return False
+        write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        self._continue_sent = True
+        return True
+
+    def reject_body(self):
+        """
+        Decline the request body (when authentication, a quota or a size check fails for
+        instance) without reading it.
+
+        POST and FILES are left empty and parse_request_body() becomes a no-op. It's
+        up to the caller to send the final response to the client. The part of the
+        body already spooled by feed() is discarded, the rest is ignored by feed().
+        """
+        self._post, self._files = QueryDict(self.settings, encoding=self.encoding), MultiValueDict()
+        self.POST = self._post
+        self.FILES = self._files
+        self._body = ''
+        self.body_rejected = True
+        self._request_body_parsed = True
+        if self._feed_body is not None:
+            #_feed_body_size is kept to tell where the rejected body ends
+            self._feed_body.close()
+            self._feed_body = None
+
+    def feed(self, data):
+        """
+        Push-based counterpart of parse() for non-blocking servers.
+
+        Instead of pulling bytes from request_stream with blocking reads, the
+        caller (an event loop's data_received() callback for instance) hands
+        over the bytes as they arrive from the transport. The request header
+        is parsed as soon as it is complete; the body is spooled (in memory up
+        to settings.FILE_UPLOAD_MAX_MEMORY_SIZE, on disk otherwise) until the
+        declared Content-Length is received and is then parsed. A request with
+        neither Content-Length nor Transfer-Encoding has no body (RFC 7230
+        section 3.3.3) and is complete with its header.
+
+        Return True once both the request header and the body have been parsed.
+        """
+        if self.body_rejected and self._feed_content_length is not None:
+            #the rest of a rejected body is dropped, what follows it belongs
+            #to the next request
+            remaining = max(0, self._feed_content_length - self._feed_body_size)
+            self._feed_body_size += min(len(data), remaining)
+            self.trailing_data += data[remaining:]
+            return True
+        if self._request_body_parsed:
+            self.trailing_data += data
+            return True
+
+        if not self._request_header_parsed:
+            #look for the end of the header, accounting for a '\r\n\r\n'
+            #sequence that straddles the previous and the current data
+            search_start = max(0, len(self._feed_buffer) - 3)
+            self._feed_buffer += data
+            request_header_end = self._feed_buffer.find(b'\r\n\r\n', search_start)
+            if request_header_end == -1:
+                return False
+
+            #account for len('\r\n\r\n')
+            request_header_end += 4
+            data = self._feed_buffer[request_header_end:]
+            self.stream = BytesIO(self._feed_buffer[:request_header_end])
+            self._feed_buffer = b''
+            self.parse_request_header()
+            #reject an oversized body before spooling any of it
+            self.check_content_length()
+            self._feed_content_length = self._declared_content_length()
+            request_headers = self.META.get(MetaDict.Info.REQ_HEADERS, {})
+            if 'Content-Length' not in request_headers and 'Transfer-Encoding' not in request_headers:
+                self._feed_content_length = 0
+            self._feed_body = SpooledTemporaryFile(max_size=self.settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+                                                   dir=self.settings.FILE_UPLOAD_TEMP_DIR)
+
+        if self._feed_content_length is not None:
+            remaining = self._feed_content_length - self._feed_body_size
+            self.trailing_data += data[remaining:]
+            data = data[:remaining]
+        self._feed_body.write(data)
+        self._feed_body_size += len(data)
+
+        if self._feed_content_length is not None and\
+            self._feed_body_size >= self._feed_content_length:
+            self._parse_fed_body()
+            return True
+        return False
+
+    def feed_eof(self):
+        """
+        Signal that the transport has been closed by the client.
+
+        The request is parsed with what was received: a body the client cut
+        short, or one whose end feed() can't tell (an invalid Content-Length,
+        a Transfer-Encoding).
+
+        Return True if the request could be parsed completely.
+        """
+        if self._request_body_parsed:
+            return True
+        if not self._request_header_parsed:
+            #let parse_request_header() report the incomplete header
+            self.stream = BytesIO(self._feed_buffer)
+            self._feed_buffer = b''
+            self.parse_request_header()
+        self._parse_fed_body()
+        return True
+
+    def _parse_fed_body(self):
+        """
+        Parse the body spooled by feed() and release the spool.
+        """
+        body = self._feed_body
+        body.seek(0)
+        self.body_stream = ChunkIter(body)
+        try:
+            self.parse_request_body()
+        finally:
+            self._feed_body = None
+            self._feed_body_size = 0
+            body.close()
+
+    def _declared_content_length(self):
+        """
+        Return the value of the Content-Length request header as an int or None
+        if it is not present or invalid.
+        """
+        request_headers = self.META.get(MetaDict.Info.REQ_HEADERS, {})
+        try:
+            content_length = int(request_headers.get('Content-Length'))
+        except (ValueError, TypeError):
+            return None
+        if content_length < 0:
+            return None
+        return content_length
+
+    def check_content_length(self):
+        """
+        Admission control for the request body, to be run after parse_request_header().
+
+        Compare the declared Content-Length against settings.CONTENT_LENGTH_LIMITS
+        and, for bodies that are held in memory (anything but multipart/*),
+        against settings.DATA_UPLOAD_MAX_MEMORY_SIZE. A request that's going to
+        be rejected anyway is rejected without reading any of its body.
+
+        Raise RequestDataTooBig if a limit is exceeded, return the declared
+        Content-Length (None if there's none) otherwise.
+        """
+        content_length = self._declared_content_length()
+        if content_length is None:
+            return None
+
+        limits = self.settings.CONTENT_LENGTH_LIMITS
+        limit = limits.get(self.content_type, limits.get('*'))
+        if limit is not None and content_length > limit:
+            raise RequestDataTooBig('Request body exceeded settings.CONTENT_LENGTH_LIMITS.')
+
+        #multipart/* bodies are streamed to the upload handlers and are
+        #limited field by field by MultiPartParser
+        if not (self.content_type or '').startswith('multipart/') and\
+            self.settings.DATA_UPLOAD_MAX_MEMORY_SIZE is not None and\
+            content_length > self.settings.DATA_UPLOAD_MAX_MEMORY_SIZE:
+            raise RequestDataTooBig('Request body exceeded settings.DATA_UPLOAD_MAX_MEMORY_SIZE.')
+
+        return content_length
+
     def _parse_file_upload(self, META, post_data):
         """Return a tuple of (POST QueryDict, FILES MultiValueDict)."""
-        parser = MultiPartParser(META, post_data, self.upload_handlers, self.settings ,self.encoding)        
-        return parser.parse()
+        parser = MultiPartParser(META, post_data, self.upload_handlers, self.settings ,self.encoding,
+                                 fields=self.multipart_fields)
+        try:
+            return parser.parse()
+        finally:
+            self._release_handlers()
+
+    def iter_parts(self):
+        """
+        Alternative to parse_request_body() for multipart/form-data bodies that
+        yields each part (a multipartparser.Part) as it is reached instead of
+        storing the fields and the files in POST and FILES.
+
+        The caller reads each part's payload (with part.read() or by iterating
+        over it) before asking for the next part; unread payload is skipped.
+        Nothing is buffered besides the current chunk, so a part can be
+        streamed straight to its destination. POST and FILES stay empty.
+        """
+        if self._request_body_parsed:
+            return
+
+        if not self._request_header_parsed:
+            raise RequestHeaderParseException("Request header not parsed.Parse request header first.")
+
+        if self.content_type != 'multipart/form-data':
+            raise MultiPartParserError('Invalid Content-Type: %s' % self.content_type)
+
+        self.check_content_length()
+
+        #the body is consumed by the iteration, it can't be parsed again
+        self._request_body_parsed = True
+        #the upload handlers aren't called, but their chunk_size is honored
+        parser = MultiPartParser(self.META.get(MetaDict.Info.REQ_HEADERS), self._stream, self.upload_handlers,
+                                 self.settings, self.encoding, fields=self.multipart_fields)
+        try:
+            for part in parser.iter_parts():
+                yield part
+        finally:
+            self._release_handlers()
     
     def body(self):
         """
@@ -500,9 +770,6 @@ class HttpRequest(object,):
         #sanity check for a duplicate call
         if self._request_body_parsed:
             return
-        
-        #initialize the upload_hanldlers
-        self._initialize_handlers()
 
         #if header not parsed already
         #if parse_request_body is called, then it means
@@ -512,6 +779,8 @@ class HttpRequest(object,):
             self._mark_post_parse_error()
             raise RequestHeaderParseException("Request header not parsed.Parse request header first.")
 
+        self.check_content_length()
+
         #body_stream = self.request_stream
         body_stream = self._stream
         data = body_stream.read(1)
@@ -519,6 +788,9 @@ class HttpRequest(object,):
         #check if the body is empty
         if not data:
             self._post, self._files = QueryDict(self.settings, encoding=self.encoding), MultiValueDict()
+            self._request_body_parsed = True
+            self.POST = self._post
+            self.FILES = self._files
             return
         body_stream.unget(data)
         
@@ -572,6 +844,13 @@ class HttpRequest(object,):
         except IOError as e:
             raise_(UnreadablePostError(*e.args), e)
 
+    def tell(self):
+        """
+        Return the position in the request stream of the next byte read(), the
+        start of the body once the request header is parsed.
+        """
+        return self._stream.tell()
+
     def readline(self, *args, **kwargs):
         try:
             return self._stream.readline(*args, **kwargs)
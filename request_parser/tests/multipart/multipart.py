@@ -0,0 +1,554 @@
+import base64
+import binascii
+import copy
+import os
+import pickle
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+from os.path import join
+
+from request_parser.http.request import HttpRequest
+from request_parser.http.multipartparser import MultiPartParser, MultiPartParserError, FieldValue
+from request_parser.http.multipartindex import MultiPartIndex
+from request_parser.files.utils import get_abs_path
+from request_parser.files.memorybudget import get_memory_budget
+from request_parser.files.uploadhandler import MemoryFileUploadHandler, PolicyFileUploadHandler, StopUpload
+from request_parser.conf.settings import Settings
+from request_parser.exceptions.exceptions import TooManyFieldsSent
+from request_parser.utils.encoding import force_text
+from request_parser.utils.datastructures import LazyStream, ChunkIter, skip_file
+
+class MultiPartParserTests(unittest.TestCase):
+    """
+    Test MultiPartParser directly over in-memory multipart/form-data bodies.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.boundary = '----WebKitFormBoundaryOmz20xyMCkE27rN7'
+
+        #a file whose content looks like the beginning of a boundary at several places
+        cls.file_content = ('\r\n------WebKitForm\r\n--' * 50) + '\r\n------WebKitFormBoundaryOmz20xyMCkE27rN\r\n-'
+
+        cls.body = '--' + cls.boundary + '\r\n'
+        cls.body += 'Content-Disposition: form-data; name="id"\r\n'
+        cls.body += 'Content-Type: text/plain\r\n\r\n'
+        cls.body += '123e4567-e89b-12d3-a456-426655440000\r\n'
+        cls.body += '--' + cls.boundary + '\r\n'
+        cls.body += 'Content-Disposition: form-data; name="empty"\r\n\r\n'
+        cls.body += '\r\n'
+        cls.body += '--' + cls.boundary + '\r\n'
+        cls.body += 'Content-Disposition: form-data; name="upload"; filename="tricky.txt"\r\n'
+        cls.body += 'Content-Type: text/plain\r\n\r\n'
+        cls.body += cls.file_content + '\r\n'
+        cls.body += '--' + cls.boundary + '--\r\n'
+
+    #'buffer' parses the whole body in memory with BufferParser
+    engines = ('stream', 'flat', 'buffer')
+
+    @staticmethod
+    def engine_settings(engine, settings_dict=None):
+        """
+        Return Settings (with the given values) that make MultiPartParser parse with engine.
+        """
+        settings_dict = dict(settings_dict or {})
+        if engine == 'buffer':
+            settings_dict[Settings.Key.MULTIPART_BUFFER_MAX_SIZE] = 2 ** 31
+        else:
+            settings_dict[Settings.Key.MULTIPART_ENGINE] = engine
+            settings_dict[Settings.Key.MULTIPART_BUFFER_MAX_SIZE] = None
+        return Settings(settings_dict)
+
+    def parse(self, body, chunk_size=64 * 2 ** 10, settings=None, fields=None):
+        """
+        Parse body with a MemoryFileUploadHandler reading chunk_size bytes at a time.
+        """
+        settings = settings or Settings.default()
+        META = {
+            'Content-Type' : 'multipart/form-data; boundary=' + self.boundary,
+            'Content-Length' : str(len(body))
+        }
+        handler = MemoryFileUploadHandler()
+        handler.chunk_size = chunk_size
+        parser = MultiPartParser(META, BytesIO(body), [handler], settings, fields=fields)
+        return parser.parse()
+
+    def test_boundary_split_across_chunks(self):
+        """
+        Test that the parsed parts are the same whatever the chunk boundaries are.
+        """
+        for engine in self.engines:
+            settings = self.engine_settings(engine)
+            for chunk_size in (1, 2, 3, 7, 40, 41, 42, 43, 64, 1000, 64 * 2 ** 10):
+                post, files = self.parse(self.body, chunk_size, settings)
+                self.assertEqual('123e4567-e89b-12d3-a456-426655440000', post['id']['data'], (engine, chunk_size))
+                self.assertEqual('', post['empty']['data'], (engine, chunk_size))
+                self.assertEqual(self.file_content, files['upload'].read(), (engine, chunk_size))
+
+    def test_flat_engine(self):
+        """
+        Test that the flat engine gives the same results as the default one for a complex request.
+        """
+        request_file = join(get_abs_path("tests/request parse test files"), "complex-request1.txt")
+        requests = []
+        for engine in ('stream', 'flat'):
+            request_stream = open(request_file, 'r')
+            http_request = HttpRequest(request_stream, self.engine_settings(engine))
+            http_request.parse()
+            request_stream.close()
+            requests.append(http_request)
+
+        stream_request, flat_request = requests
+        self.assertDictEqual(stream_request.POST, flat_request.POST)
+        self.assertEqual(['profileImage'], list(flat_request.FILES))
+        stream_file = stream_request.FILES['profileImage']
+        flat_file = flat_request.FILES['profileImage']
+        self.assertEqual(stream_file.size, flat_file.size)
+        self.assertEqual(stream_file.read(), flat_file.read())
+
+        #preamble, epilogue and a part without header
+        body = 'preamble\r\n--' + self.boundary + '\r\n\r\nno header\r\n'
+        body += '--' + self.boundary + '\r\nContent-Disposition: form-data; name="a"\r\n\r\n1\r\n'
+        body += '--' + self.boundary + '--\r\nepilogue'
+        for engine in self.engines:
+            post, files = self.parse(body, settings=self.engine_settings(engine))
+            self.assertEqual(['a'], list(post), engine)
+            self.assertEqual('1', post['a']['data'], engine)
+
+    def test_long_part_header(self):
+        """
+        Test part headers longer than the chunk size, up to settings.MAX_PART_HEADER_SIZE.
+        """
+        long_value = 'x' * 3000
+        body = '--' + self.boundary + '\r\n'
+        body += 'Content-Disposition: form-data; name="long"\r\n'
+        body += 'X-Padding: ' + long_value + '\r\n\r\n'
+        body += 'value\r\n'
+        body += '--' + self.boundary + '\r\n'
+        body += 'Content-Disposition: form-data; name="short"\r\n\r\n'
+        body += 'short value\r\n'
+        body += '--' + self.boundary + '--\r\n'
+
+        for engine in self.engines:
+            settings = self.engine_settings(engine)
+            for chunk_size in (1, 7, 1000, 64 * 2 ** 10):
+                post, files = self.parse(body, chunk_size, settings)
+                self.assertEqual('value', post['long']['data'], (engine, chunk_size))
+                self.assertEqual('short value', post['short']['data'], (engine, chunk_size))
+
+            #a header over the limit makes the part raw, the other parts are still parsed
+            settings = self.engine_settings(engine, {Settings.Key.MAX_PART_HEADER_SIZE : 1024})
+            post, files = self.parse(body, 1000, settings)
+            self.assertEqual(['short'], list(post), engine)
+
+    def test_transfer_encodings(self):
+        """
+        Test base64 and quoted-printable fields and files decoded over any chunk size.
+        """
+        content = 'caf\xc3\xa9 = 100%\r\n' * 20 + 'end'
+        encoded_base64 = base64.encodestring(content)
+        encoded_qp = binascii.b2a_qp(content, istext=False)
+        self.assertIn('=\r\n', encoded_qp)
+
+        body = ''
+        for name, transfer_encoding, encoded in (('b64', 'base64', encoded_base64),
+                                                 ('qp', 'quoted-printable', encoded_qp)):
+            body += '--' + self.boundary + '\r\n'
+            body += 'Content-Disposition: form-data; name="' + name + '"\r\n'
+            body += 'Content-Transfer-Encoding: ' + transfer_encoding + '\r\n\r\n'
+            body += encoded + '\r\n'
+            body += '--' + self.boundary + '\r\n'
+            body += 'Content-Disposition: form-data; name="' + name + '_file"; filename="' + name + '.txt"\r\n'
+            body += 'Content-Transfer-Encoding: ' + transfer_encoding + '\r\n\r\n'
+            body += encoded + '\r\n'
+        body += '--' + self.boundary + '--\r\n'
+
+        for engine in self.engines:
+            settings = self.engine_settings(engine)
+            for chunk_size in (1, 2, 3, 5, 77, 64 * 2 ** 10):
+                post, files = self.parse(body, chunk_size, settings)
+                for name in ('b64', 'qp'):
+                    self.assertEqual(content, post[name]['data'], (engine, chunk_size, name))
+                    self.assertEqual(content, files[name + '_file'].read(), (engine, chunk_size, name))
+
+    def test_selected_fields(self):
+        """
+        Test that only the selected parts are parsed, the others counting towards
+        settings.DATA_UPLOAD_MAX_NUMBER_FIELDS.
+        """
+        for engine in self.engines:
+            settings = self.engine_settings(engine)
+            post, files = self.parse(self.body, settings=settings, fields=['upload', 'missing'])
+            self.assertEqual([], list(post))
+            self.assertEqual(['upload'], list(files))
+            self.assertEqual(self.file_content, files['upload'].read())
+
+            post, files = self.parse(self.body, settings=settings,
+                                     fields=lambda name, meta_data: 'content-type' in meta_data)
+            self.assertEqual(['id'], list(post))
+            self.assertEqual(['upload'], list(files))
+
+            settings = self.engine_settings(engine, {Settings.Key.DATA_UPLOAD_MAX_FIELDS : 1})
+            with self.assertRaises(TooManyFieldsSent):
+                self.parse(self.body, settings=settings, fields=['upload'])
+
+        request_file = join(get_abs_path("tests/request parse test files"), "complex-request1.txt")
+        request_stream = open(request_file, 'r')
+        http_request = HttpRequest(request_stream)
+        http_request.multipart_fields = ['id']
+        http_request.parse()
+        request_stream.close()
+        self.assertEqual(['id'], list(http_request.POST))
+        self.assertEqual([], list(http_request.FILES))
+
+    def test_iter_parts(self):
+        """
+        Test that HttpRequest.iter_parts() yields the parts one by one with their payload.
+        """
+        for engine in self.engines:
+            request = 'POST /upload HTTP/1.1\r\n'
+            request += 'Host: example.com\r\n'
+            request += 'Content-Type: multipart/form-data; boundary=' + self.boundary + '\r\n'
+            request += 'Content-Length: ' + str(len(self.body)) + '\r\n\r\n'
+            request += self.body
+            http_request = HttpRequest(BytesIO(request), self.engine_settings(engine))
+            http_request.parse_request_header()
+
+            parts = []
+            for part in http_request.iter_parts():
+                parts.append(part)
+                if part.name == 'id':
+                    #partial reads, the rest is skipped
+                    self.assertEqual('text/plain', part.content_type)
+                    self.assertEqual('123e', part.read(4))
+                    self.assertEqual('4567', part.read(4))
+                elif part.name == 'upload':
+                    self.assertTrue(part.is_file)
+                    self.assertEqual('tricky.txt', part.filename)
+                    self.assertEqual(self.file_content, ''.join(part))
+
+            self.assertEqual(['id', 'empty', 'upload'], [part.name for part in parts], engine)
+            self.assertEqual([], list(http_request.POST))
+            self.assertEqual([], list(http_request.iter_parts()))
+
+            #the files don't count towards DATA_UPLOAD_MAX_NUMBER_FIELDS, as in parse()
+            META = {
+                'Content-Type' : 'multipart/form-data; boundary=' + self.boundary,
+                'Content-Length' : str(len(self.body))
+            }
+            settings = self.engine_settings(engine, {Settings.Key.DATA_UPLOAD_MAX_FIELDS : 2})
+            parser = MultiPartParser(META, BytesIO(self.body), [MemoryFileUploadHandler()], settings)
+            self.assertEqual(['id', 'empty', 'upload'], [part.name for part in parser.iter_parts()], engine)
+            settings = self.engine_settings(engine, {Settings.Key.DATA_UPLOAD_MAX_FIELDS : 1})
+            parser = MultiPartParser(META, BytesIO(self.body), [MemoryFileUploadHandler()], settings)
+            with self.assertRaises(TooManyFieldsSent):
+                list(parser.iter_parts())
+
+    def test_skip(self):
+        """
+        Test skipping streams with a seek or with discarding reads, and that parsing
+        skips no more of the input than the declared Content-Length.
+        """
+        class Unseekable(object):
+            def __init__(self, data):
+                self._stream = BytesIO(data)
+            def read(self, size=-1):
+                return self._stream.read(size)
+
+        data = 'x' * 300000 + 'tail'
+        for flo in (BytesIO(data), Unseekable(data)):
+            self.assertEqual(300000, skip_file(flo, 300000))
+            self.assertEqual('tail', flo.read())
+            self.assertEqual(0, skip_file(flo))
+
+        stream = LazyStream(ChunkIter(Unseekable('abcdefghij'), 3))
+        self.assertEqual('ab', stream.read(2))
+        self.assertEqual(5, stream.skip(5))
+        self.assertEqual(7, stream.tell())
+        self.assertEqual('hij', stream.read())
+
+        stream = LazyStream(iter(['abc', 'def', 'ghi']))
+        self.assertEqual('a', stream.read(1))
+        self.assertEqual(4, stream.skip(4))
+        self.assertEqual('fghi', stream.read())
+
+        class StopUploadHandler(MemoryFileUploadHandler):
+            chunk_size = 64
+            def new_file(self, *args, **kwargs):
+                raise StopUpload()
+
+        #a stopped upload skips the rest of the body, but not the pipelined
+        #request following it
+        for engine in self.engines:
+            META = {
+                'Content-Type' : 'multipart/form-data; boundary=' + self.boundary,
+                'Content-Length' : str(len(self.body))
+            }
+            input_data = LazyStream(BytesIO(self.body + 'GET / HTTP/1.1\r\n\r\n'))
+            parser = MultiPartParser(META, input_data, [StopUploadHandler()],
+                                     self.engine_settings(engine))
+            post, files = parser.parse()
+            self.assertEqual(['empty', 'id'], sorted(post))
+            self.assertEqual(len(self.body), input_data.tell())
+            self.assertEqual('GET / HTTP/1.1\r\n\r\n', input_data.read())
+
+    def test_offset_index(self):
+        """
+        Test indexing the parts of a request stored in a file, and persisting the index.
+        """
+        request_file = join(get_abs_path("tests/request parse test files"), "complex-request1.txt")
+        request_stream = open(request_file, 'rb')
+        http_request = HttpRequest(request_stream)
+        http_request.parse()
+        request_stream.close()
+
+        request_stream = open(request_file, 'rb')
+        index = MultiPartIndex.from_request(request_stream)
+        self.assertEqual(['id', 'address', 'profileImage'], [entry.name for entry in index])
+
+        id_entry = index.get('id')[0]
+        self.assertFalse(id_entry.is_file)
+        self.assertEqual('text/plain', id_entry.content_type)
+        self.assertEqual(http_request.POST['id']['data'], index.read(request_stream, id_entry))
+        request_stream.seek(id_entry.header_start)
+        header = request_stream.read(id_entry.header_end - id_entry.header_start)
+        self.assertTrue(header.startswith('Content-Disposition: form-data; name="id"'))
+
+        image_entry = index.get('profileImage')[0]
+        self.assertEqual('image1.png', image_entry.filename)
+        self.assertEqual('base64', image_entry.transfer_encoding)
+        reader = index.open(request_stream, image_entry)
+        image = base64.b64decode(''.join(reader))
+        self.assertEqual(http_request.FILES['profileImage'].read(), image)
+
+        #a body that doesn't start at the beginning of the file, with a preamble
+        body = 'preamble\r\n' + self.body
+        index = MultiPartIndex.build(BytesIO('garbage' + body), self.boundary, len('garbage'), chunk_size=7)
+        self.assertEqual(['id', 'empty', 'upload'], [entry.name for entry in index])
+        self.assertEqual('', index.read(BytesIO('garbage' + body), index.get('empty')[0]))
+        self.assertEqual(self.file_content, index.read(BytesIO('garbage' + body), index.get('upload')[0]))
+
+        self.assertEqual(len(body), index.body_size)
+
+        index_fd, index_path = tempfile.mkstemp(suffix='.json')
+        os.close(index_fd)
+        try:
+            index.save(index_path)
+            self.assertEqual(index, MultiPartIndex.load(index_path))
+            self.assertEqual(index, MultiPartIndex.load(index_path, BytesIO('garbage' + body)))
+
+            #an index isn't used on a body it doesn't describe: one of another
+            #size, or of the same size with the parts elsewhere
+            with self.assertRaises(MultiPartParserError):
+                MultiPartIndex.load(index_path, BytesIO('garbage' + body + 'epilogue'))
+            shifted_body = 'garbage' + body.replace('preamble', 'preambleX')[:-1]
+            with self.assertRaises(MultiPartParserError):
+                MultiPartIndex.load(index_path, BytesIO(shifted_body))
+            with self.assertRaises(MultiPartParserError):
+                MultiPartIndex.load(index_path).read(BytesIO(shifted_body), index.get('upload')[0])
+        finally:
+            os.remove(index_path)
+        request_stream.close()
+
+    def test_field_value(self):
+        """
+        Test that POST field values behave like the dictionaries they replace.
+        """
+        post, files = self.parse(self.body)
+        value = post['id']
+        self.assertIsInstance(value, FieldValue)
+        expected = {
+            'data' : '123e4567-e89b-12d3-a456-426655440000',
+            'content-type' : 'text/plain',
+            'transfer-encoding' : '',
+            'content-type-extra' : {}
+        }
+        self.assertEqual(expected, value)
+        self.assertEqual(value, expected)
+        self.assertNotEqual(value, dict(expected, data='other'))
+        self.assertEqual(expected['data'], value['data'])
+        self.assertEqual(expected['data'], value.data)
+        self.assertEqual(expected['content-type'], value.get('content-type'))
+        self.assertEqual(None, value.get('missing'))
+        self.assertRaises(KeyError, lambda: value['missing'])
+        self.assertEqual(sorted(expected), sorted(value))
+        self.assertEqual(expected, dict(value.items()))
+        self.assertIn('content-type-extra', value)
+        self.assertEqual(expected, copy.deepcopy(value))
+        for protocol in (0, 2):
+            self.assertEqual(expected, pickle.loads(pickle.dumps(value, protocol)))
+
+        value = FieldValue('caf\xc3\xa9', 'text/plain', None, {'charset' : 'utf-8'}, 'utf-8')
+        self.assertEqual({'charset' : 'utf-8'}, value['content-type-extra'])
+        self.assertEqual(force_text('caf\xc3\xa9', 'utf-8'), value['data'])
+
+        #much smaller than the dictionaries
+        self.assertLess(sys.getsizeof(value), sys.getsizeof(expected) / 2)
+
+    def test_trusted_part_content_length(self):
+        """
+        Test reading the parts that declare their Content-Length without looking for the boundary.
+        """
+        #the boundary itself can only be in a part read by its Content-Length
+        file_content = self.file_content + '\r\n--' + self.boundary + '\r\n'
+        def make_body(declared_length):
+            body = '--' + self.boundary + '\r\n'
+            body += 'Content-Disposition: form-data; name="id"\r\n\r\n'
+            body += 'no length\r\n'
+            body += '--' + self.boundary + '\r\n'
+            body += 'Content-Disposition: form-data; name="upload"; filename="tricky.txt"\r\n'
+            body += 'Content-Length: ' + str(declared_length) + '\r\n\r\n'
+            body += file_content + '\r\n'
+            body += '--' + self.boundary + '--\r\n'
+            return body
+
+        settings = self.engine_settings('flat', {Settings.Key.TRUST_PART_CONTENT_LENGTH : True})
+        for chunk_size in (1, 3, 41, 64 * 2 ** 10):
+            post, files = self.parse(make_body(len(file_content)), chunk_size, settings)
+            self.assertEqual('no length', post['id']['data'], chunk_size)
+            self.assertEqual(file_content, files['upload'].read(), chunk_size)
+
+        for declared_length in (len(file_content) - 1, len(file_content) + 1, len(file_content) * 2):
+            with self.assertRaises(MultiPartParserError):
+                self.parse(make_body(declared_length), 1000, settings)
+
+    def test_nested_multipart(self):
+        """
+        Test multipart/mixed and multipart/related parts nested in the form.
+        """
+        mixed_boundary = 'BbC04y'
+        related_boundary = 'MIME_boundary'
+        soap_envelope = '<soap:Envelope><soap:Body>upload</soap:Body></soap:Envelope>'
+        attachment = ('\r\n--' + related_boundary[:-1] + '\r\n') * 100
+
+        body = '--' + self.boundary + '\r\n'
+        body += 'Content-Disposition: form-data; name="files"\r\n'
+        body += 'Content-Type: multipart/mixed; boundary=' + mixed_boundary + '\r\n\r\n'
+        body += '--' + mixed_boundary + '\r\n'
+        body += 'Content-Disposition: file; filename="file1.txt"\r\n'
+        body += 'Content-Type: text/plain\r\n\r\n'
+        body += '... contents of file1.txt ...\r\n'
+        body += '--' + mixed_boundary + '\r\n'
+        body += 'Content-Disposition: file; filename="file2.txt"\r\n\r\n'
+        body += self.file_content + '\r\n'
+        body += '--' + mixed_boundary + '--\r\n'
+        body += '--' + self.boundary + '\r\n'
+        body += 'Content-Disposition: form-data; name="soap"\r\n'
+        body += 'Content-Type: multipart/related; type="text/xml"; boundary=' + related_boundary + '\r\n\r\n'
+        body += '--' + related_boundary + '\r\n'
+        body += 'Content-Type: text/xml; charset=UTF-8\r\n\r\n'
+        body += soap_envelope + '\r\n'
+        body += '--' + related_boundary + '\r\n'
+        body += 'Content-Type: application/octet-stream\r\n'
+        body += 'Content-ID: <attachment1@example.com>\r\n\r\n'
+        body += attachment + '\r\n'
+        body += '--' + related_boundary + '--\r\n'
+        body += '--' + self.boundary + '\r\n'
+        body += 'Content-Disposition: form-data; name="id"\r\n\r\n'
+        body += 'after\r\n'
+        body += '--' + self.boundary + '--\r\n'
+
+        for engine in self.engines:
+            for chunk_size in (1, 7, 64 * 2 ** 10):
+                post, files = self.parse(body, chunk_size, self.engine_settings(engine))
+                self.assertEqual(['file1.txt', 'file2.txt'], [f.name for f in files.getlist('files')], (engine, chunk_size))
+                file1, file2 = files.getlist('files')
+                self.assertEqual('... contents of file1.txt ...', file1.read())
+                self.assertEqual(self.file_content, file2.read())
+                self.assertEqual(soap_envelope, post['soap']['data'])
+                self.assertEqual('text/xml', post['soap']['content-type'])
+                self.assertEqual('attachment1@example.com', files['soap'].name)
+                self.assertEqual(attachment, files['soap'].read())
+                self.assertEqual('after', post['id']['data'])
+
+            #a nested body that isn't selected is skipped as one part
+            settings = self.engine_settings(engine, {Settings.Key.DATA_UPLOAD_MAX_FIELDS : 3})
+            post, files = self.parse(body, settings=settings, fields=['id'])
+            self.assertEqual(['id'], list(post))
+            self.assertEqual([], list(files))
+
+    def test_upload_policy(self):
+        """
+        Test that PolicyFileUploadHandler skips or stops at the files breaking the
+        policy, before the next handlers store them, and keeps the files before them.
+        """
+        def upload(name, file_name, content_type, content):
+            part = '--' + self.boundary + '\r\n'
+            part += 'Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (name, file_name)
+            part += 'Content-Type: %s\r\n\r\n' % content_type
+            return part + content + '\r\n'
+
+        body = upload('good', 'notes.TXT', 'text/plain', self.file_content)
+        body += upload('script', 'run.sh', 'text/plain', 'echo')
+        body += upload('image', 'photo.png', 'image/png', 'png')
+        body += upload('big', 'big.txt', 'text/plain', 'x' * 5000)
+        body += '--' + self.boundary + '\r\n'
+        body += 'Content-Disposition: form-data; name="id"\r\n\r\n'
+        body += 'after\r\n'
+        body += '--' + self.boundary + '--\r\n'
+        META = {
+            'Content-Type' : 'multipart/form-data; boundary=' + self.boundary,
+            'Content-Length' : str(len(body))
+        }
+        policy = {
+            Settings.Key.FILE_UPLOAD_MAX_SIZE : 4096,
+            Settings.Key.FILE_UPLOAD_ALLOWED_CONTENT_TYPES : ['TEXT/*'],
+            Settings.Key.FILE_UPLOAD_ALLOWED_EXTENSIONS : ['txt'],
+        }
+
+        for engine in self.engines:
+            for chunk_size in (7, 64 * 2 ** 10):
+                request = HttpRequest()
+                policy_handler = PolicyFileUploadHandler(request)
+                memory_handler = MemoryFileUploadHandler()
+                memory_handler.chunk_size = policy_handler.chunk_size = chunk_size
+                parser = MultiPartParser(META, BytesIO(body), [policy_handler, memory_handler],
+                                         self.engine_settings(engine, policy))
+                post, files = parser.parse()
+                self.assertEqual(['good'], list(files), (engine, chunk_size))
+                self.assertEqual(self.file_content, files['good'].read())
+                self.assertEqual('after', post['id']['data'])
+                self.assertEqual([('extension', 'script'), ('content_type', 'image'), ('size', 'big')],
+                                 [(v.rule, v.field_name) for v in request.upload_policy_violations])
+
+        #'stop' gives up on the rest of the body at the first violation
+        policy[Settings.Key.FILE_UPLOAD_POLICY_ACTION] = 'stop'
+        for engine in self.engines:
+            policy_handler = PolicyFileUploadHandler()
+            parser = MultiPartParser(META, BytesIO(body), [policy_handler, MemoryFileUploadHandler()],
+                                     self.engine_settings(engine, policy))
+            post, files = parser.parse()
+            self.assertEqual(['good'], list(files), engine)
+            self.assertEqual(self.file_content, files['good'].read())
+            self.assertNotIn('id', post)
+            self.assertEqual(['extension'], [v.rule for v in policy_handler.violations])
+
+    def test_interrupted_upload(self):
+        """
+        Test that the memory reserved by the upload handlers is given back when
+        parsing fails.
+        """
+        body = '--' + self.boundary + '\r\n'
+        body += 'Content-Disposition: form-data; name="first"; filename="first.txt"\r\n\r\n'
+        body += self.file_content + '\r\n'
+        body += self.body
+        META = {
+            'Content-Type' : 'multipart/form-data; boundary=' + self.boundary,
+            'Content-Length' : str(len(body))
+        }
+
+        for engine in self.engines:
+            settings = self.engine_settings(engine, {
+                Settings.Key.DATA_UPLOAD_MAX_FIELDS : 1,
+                Settings.Key.FILE_UPLOAD_MEMORY_BUDGET : 10 * len(body) + 1,
+            })
+            budget = get_memory_budget(settings)
+            for i in range(3):
+                parser = MultiPartParser(META, BytesIO(body), [MemoryFileUploadHandler()], settings)
+                #the first file is complete when the second field is rejected
+                with self.assertRaises(TooManyFieldsSent):
+                    parser.parse()
+                self.assertEqual(0, budget.current, engine)
+
+unittest.main()
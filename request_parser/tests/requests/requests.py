@@ -433,7 +433,40 @@ class RequestTests(unittest.TestCase):
             multipart_request.parse_request_body()
         self.assertEquals("Request body exceeded settings.DATA_UPLOAD_MAX_MEMORY_SIZE.", rqdTooBig_Exception.exception.args[0])
         multipart_request_stream.close()
-     
+
+    def test_request_content_length_admission(self):
+        """
+        Test that a request whose declared Content-Length exceeds the limits is rejected before its body is read.
+        """
+        multipart_request_stream = open(self.put_request_multipart_file, 'r')
+
+        #limit multipart/form-data bodies to 512KB
+        multipart_request = HttpRequest(
+                                multipart_request_stream,
+                                Settings({Settings.Key.CONTENT_LENGTH_LIMITS : {'multipart/form-data' : 512 * (2 ** 10)}})
+                            )
+        multipart_request.parse_request_header()
+        body_position = multipart_request_stream.tell()
+        with self.assertRaises(RequestDataTooBig) as rqdTooBig_Exception:
+            multipart_request.parse_request_body()
+        self.assertEquals("Request body exceeded settings.CONTENT_LENGTH_LIMITS.", rqdTooBig_Exception.exception.args[0])
+        #nothing of the body was read
+        self.assertEqual(body_position, multipart_request_stream.tell())
+        multipart_request_stream.close()
+
+        #the '*' limit applies to the content types that aren't listed
+        multipart_request_stream = open(self.put_request_multipart_file, 'r')
+        multipart_request = HttpRequest(
+                                multipart_request_stream,
+                                Settings({Settings.Key.CONTENT_LENGTH_LIMITS : {'*' : 1024, 'multipart/form-data' : None}})
+                            )
+        multipart_request.parse_request_header()
+        self.assertEqual(830543, multipart_request.check_content_length())
+        multipart_request.content_type = "application/json"
+        with self.assertRaises(RequestDataTooBig):
+            multipart_request.check_content_length()
+        multipart_request_stream.close()
+
     def test_invalid_request_header(self):
         #Incorrectly terminated request
         invalid_request_1 = "GET asasd\r\nHost: www.knowhere123.com\r\n"
@@ -538,4 +571,128 @@ class RequestTests(unittest.TestCase):
         #close the file
         http_request_stream.close()
 
+    def test_request_feed(self):
+        """
+        Test pushing a multipart/form-data request to HttpRequest in small pieces.
+        """
+        multipart_request_stream = open(self.put_request_multipart_file, 'r')
+        request = multipart_request_stream.read()
+        multipart_request_stream.close()
+
+        #the test file declares a shorter Content-Length than its body, so
+        #declare the right one and pipeline another request after it
+        body_start = request.find('\r\n\r\n') + 4
+        request = request.replace('Content-Length: 830543', 'Content-Length: {}'.format(len(request) - body_start))
+        request += "GET / HTTP/1.1\r\n"
+        multipart_request = HttpRequest()
+
+        #feed the request in 1KB pieces as a server would receive them
+        parsed = False
+        for start in range(0, len(request), 1024):
+            self.assertFalse(parsed)
+            parsed = multipart_request.feed(request[start:start + 1024])
+
+        self.assertTrue(parsed)
+        self.assertEqual("www.knowhere123.com", multipart_request.get_host())
+        self.assertEqual('123e4567-e89b-12d3-a456-426655440000', multipart_request.POST['id']['data'])
+        self.assertIn('profileImage', multipart_request.FILES)
+        self.assertEqual("GET / HTTP/1.1\r\n", multipart_request.trailing_data)
+
+    def test_request_feed_no_body(self):
+        """
+        Test a pushed request without Content-Length nor Transfer-Encoding is complete with its header.
+        """
+        request = "GET /search?q=kitten HTTP/1.1\r\nHost: www.knowhere123.com\r\n\r\n"
+
+        http_request = HttpRequest()
+        for start in range(0, len(request) - 1, 7):
+            self.assertFalse(http_request.feed(request[start:min(start + 7, len(request) - 1)]))
+        self.assertTrue(http_request.feed(request[-1:]))
+        self.assertEqual("www.knowhere123.com", http_request.get_host())
+        self.assertEqual('kitten', http_request.GET['q'])
+        self.assertEqual(0, len(http_request.POST))
+        self.assertEqual('', http_request.trailing_data)
+
+    def test_request_feed_eof(self):
+        """
+        Test a pushed request whose body is cut short by the end of the connection.
+        """
+        request = "POST /form HTTP/1.1\r\nHost: www.knowhere123.com\r\nContent-Length: 100\r\n"
+        request += "Content-Type: application/x-www-form-urlencoded\r\n\r\nq=asdfadsf&source=hp"
+
+        http_request = HttpRequest()
+        self.assertFalse(http_request.feed(request[:10]))
+        self.assertFalse(http_request.feed(request[10:]))
+        self.assertEqual("www.knowhere123.com", http_request.get_host())
+        self.assertTrue(http_request.feed_eof())
+        self.assertEqual('asdfadsf', http_request.POST['q'])
+        self.assertEqual('hp', http_request.POST['source'])
+
+    def test_request_feed_empty_body(self):
+        """
+        Test a pushed request with an empty body is complete, and stays so, once its header is.
+        """
+        request = "POST /form HTTP/1.1\r\nHost: www.knowhere123.com\r\nContent-Length: 0\r\n"
+        request += "Content-Type: application/x-www-form-urlencoded\r\n\r\n"
+
+        http_request = HttpRequest()
+        self.assertTrue(http_request.feed(request))
+        self.assertEqual(0, len(http_request.POST))
+        self.assertEqual(0, len(http_request.FILES))
+        #what follows belongs to the next request
+        self.assertTrue(http_request.feed("GET / HTTP/1.1\r\n"))
+        self.assertTrue(http_request.feed_eof())
+        self.assertEqual("GET / HTTP/1.1\r\n", http_request.trailing_data)
+
+    def test_request_feed_rejected_body(self):
+        """
+        Test a pushed request whose body is rejected half way releases its spool
+        and ignores the rest of the body.
+        """
+        request = "POST /form HTTP/1.1\r\nHost: www.knowhere123.com\r\nContent-Length: 20\r\n"
+        request += "Content-Type: application/x-www-form-urlencoded\r\n\r\nq=asdfadsf&source=hp"
+
+        http_request = HttpRequest()
+        self.assertFalse(http_request.feed(request[:-15]))
+        feed_body = http_request._feed_body
+        http_request.reject_body()
+        self.assertTrue(feed_body.closed)
+        self.assertTrue(http_request.feed(request[-15:-5]))
+        #what follows the rejected body belongs to the next request
+        self.assertTrue(http_request.feed(request[-5:] + "GET / HTTP/1.1\r\n"))
+        self.assertTrue(http_request.feed_eof())
+        self.assertEqual([], list(http_request.POST))
+        self.assertEqual("GET / HTTP/1.1\r\n", http_request.trailing_data)
+
+    def test_request_expect_continue(self):
+        """
+        Test the Expect: 100-continue handshake hooks.
+        """
+        request = "POST /form HTTP/1.1\r\nHost: www.knowhere123.com\r\nExpect: 100-continue\r\nContent-Length: 20\r\n"
+        request += "Content-Type: application/x-www-form-urlencoded\r\n\r\nq=asdfadsf&source=hp"
+
+        #allow the body
+        written = []
+        http_request = HttpRequest(BytesIO(request))
+        http_request.parse(expect_continue=lambda request: request.send_continue(written.append))
+        self.assertEqual(['HTTP/1.1 100 Continue\r\n\r\n'], written)
+        self.assertFalse(http_request.body_rejected)
+        self.assertEqual('asdfadsf', http_request.POST['q'])
+        #the interim response is sent only once
+        self.assertFalse(http_request.send_continue(written.append))
+
+        #reject the body without reading it
+        request_stream = BytesIO(request)
+        http_request = HttpRequest(request_stream)
+        http_request.parse(expect_continue=lambda request: request.reject_body())
+        self.assertTrue(http_request.body_rejected)
+        self.assertEqual([], list(http_request.POST))
+        self.assertEqual('q=asdfadsf&source=hp', http_request.read())
+        self.assertFalse(http_request.send_continue(written.append))
+
+        #no Expect header
+        http_request = HttpRequest(BytesIO(request.replace("Expect: 100-continue\r\n", "")))
+        http_request.parse(expect_continue=lambda request: self.fail("Hook called without Expect header."))
+        self.assertEqual('hp', http_request.POST['source'])
+
 unittest.main()
\ No newline at end of file
@@ -40,6 +40,22 @@ class SettingsTests(unittest.TestCase):
         self.assertEqual(5 * ((2 ** 10) * (2 ** 10)), default_setting.DATA_UPLOAD_MAX_MEMORY_SIZE)
         self.assertEqual(4096, default_setting.DATA_UPLOAD_MAX_NUMBER_FIELDS)
         self.assertEqual('ISO-8859-1', default_setting.DEFAULT_CHARSET)
+        self.assertEqual({}, default_setting.CONTENT_LENGTH_LIMITS)
+        self.assertEqual(8192, default_setting.MAX_PART_HEADER_SIZE)
+        self.assertFalse(default_setting.TRUST_PART_CONTENT_LENGTH)
+        self.assertEqual(64 * 2 ** 10, default_setting.MULTIPART_BUFFER_MAX_SIZE)
+        self.assertIsNone(default_setting.FILE_UPLOAD_MEMORY_BUDGET)
+        self.assertIsNone(default_setting.FILE_UPLOAD_DESTINATION_DIR)
+        self.assertIsNone(default_setting.FILE_UPLOAD_DESTINATION_NAME)
+        self.assertEqual(0, default_setting.FILE_UPLOAD_TEMP_FILE_POOL_SIZE)
+        self.assertEqual(256 * 2 ** 10, default_setting.FILE_UPLOAD_WRITE_BUFFER_SIZE)
+        self.assertEqual(0, default_setting.FILE_UPLOAD_WRITER_THREADS)
+        self.assertEqual(8, default_setting.FILE_UPLOAD_WRITER_QUEUE_SIZE)
+        self.assertEqual('gzip', default_setting.FILE_UPLOAD_COMPRESSION['text/*'])
+        self.assertIsNone(default_setting.FILE_UPLOAD_MAX_SIZE)
+        self.assertIsNone(default_setting.FILE_UPLOAD_ALLOWED_CONTENT_TYPES)
+        self.assertIsNone(default_setting.FILE_UPLOAD_ALLOWED_EXTENSIONS)
+        self.assertEqual('skip', default_setting.FILE_UPLOAD_POLICY_ACTION)
     
     def test_custom_setting(self):
         test_file_dir = "tests/settings/test_file_dir"
@@ -68,4 +84,34 @@ class SettingsTests(unittest.TestCase):
         test_file_dir = get_abs_path(test_file_dir)
         rmdir(test_file_dir)
 
-unittest.main()
\ No newline at end of file
+    def test_shared_default_settings(self):
+        default_setting = Settings.default()
+        self.assertIsNot(default_setting, Settings.default())
+
+        #each caller can change its default settings...
+        default_setting.MAX_HEADER_SIZE = 8
+        default_setting.CONTENT_LENGTH_LIMITS['*'] = 10
+        default_setting.FILE_UPLOAD_COMPRESSION['text/*'] = 'bz2'
+        self.assertEqual(8, default_setting.MAX_HEADER_SIZE)
+        self.assertEqual({'*' : 10}, default_setting.CONTENT_LENGTH_LIMITS)
+
+        #...without changing anyone else's
+        Settings({Settings.Key.MAX_HEADER_SIZE : 32}).CONTENT_LENGTH_LIMITS['*'] = 20
+        default_setting = Settings.default()
+        self.assertEqual(16, default_setting.MAX_HEADER_SIZE)
+        self.assertEqual({}, default_setting.CONTENT_LENGTH_LIMITS)
+        self.assertEqual('gzip', default_setting.FILE_UPLOAD_COMPRESSION['text/*'])
+
+        #the settings they share can't be changed, overlays of any settings can
+        with self.assertRaises(AttributeError):
+            default_setting._base.DEFAULT_CHARSET = 'utf-8'
+        overlay = default_setting.overlay(DEFAULT_CHARSET='utf-8')
+        overlay.MAX_HEADER_SIZE = 32
+        self.assertEqual('utf-8', overlay.DEFAULT_CHARSET)
+        self.assertEqual(32, overlay.MAX_HEADER_SIZE)
+        self.assertEqual(default_setting.FILE_UPLOAD_TEMP_DIR, overlay.FILE_UPLOAD_TEMP_DIR)
+        self.assertEqual('ISO-8859-1', default_setting.DEFAULT_CHARSET)
+        self.assertEqual(16, default_setting.MAX_HEADER_SIZE)
+        self.assertFalse(hasattr(overlay, "NOT_A_SETTING"))
+
+unittest.main()
@@ -1,11 +1,25 @@
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
-from os.path import join, splitext
+import weakref
+from os import listdir
+from io import BytesIO
+from os.path import exists, getsize, join, splitext
 
 import request_parser.http.request
-from request_parser.files import uploadhandler
-from request_parser.files.uploadhandler import StopFutureHandlers
-from request_parser.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from request_parser.files import temp, uploadhandler
+from request_parser.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from request_parser.files.memorybudget import get_memory_budget
+from request_parser.files.compression import CODECS
+from request_parser.files.uploadedfile import (
+    CompressedUploadedFile, DestinationUploadedFile, InMemoryUploadedFile, SimpleUploadedFile, TemporaryUploadedFile,
+)
 from request_parser.files.utils import get_abs_path
+from request_parser.http.multipartparser import MultiPartParser, MultiPartParserError
 from request_parser.conf.settings import Settings, InvalidDirectory
 
 class UploadHandlerTest(unittest.TestCase):
@@ -257,4 +271,501 @@ class UploadHandlerTest(unittest.TestCase):
         file_name, file_extension = splitext(on_disk_file.name)
         self.assertEquals(".jpg", file_extension)    
 
+
+    def test_convenient_file_upload_rollover(self):
+        """
+        Test the content received in memory is carried over to disk when
+        ConvenientFileUploadHandler rolls over, and that the next file starts
+        in memory again.
+        """
+        #set max in memory to 500KB
+        max_in_memory_size = 500 * (2 ** 10)
+        custom_settings = Settings({Settings.Key.FILE_UPLOAD_MAX_MEMORY : max_in_memory_size}, check_presence=True)
+
+        convenient_upload_handler = uploadhandler.load_handler(self.FILE_UPLOAD_HANDLERS[2])
+        convenient_upload_handler.handle_raw_input(None, None, self.test_file_size, None, custom_settings, None)
+
+        with open(self.test_file_path, "rb") as test_file:
+            content = test_file.read()
+
+        #no size is declared so the file starts in memory
+        try:
+            convenient_upload_handler.new_file(None, "kitten.jpg", None, None, None)
+        except StopFutureHandlers:
+            pass
+        for start in range(0, len(content), self.chunk_size):
+            convenient_upload_handler.receive_data_chunk(content[start:start + self.chunk_size], start)
+        on_disk_file = convenient_upload_handler.file_complete(len(content))
+
+        self.assertTrue(isinstance(on_disk_file, TemporaryUploadedFile))
+        self.assertEquals(content, on_disk_file.read())
+        on_disk_file.close()
+
+        #with a writer thread, what was in memory is queued ahead of the rest
+        writer_settings = custom_settings.overlay(FILE_UPLOAD_WRITE_BUFFER_SIZE=1000, FILE_UPLOAD_WRITER_THREADS=1)
+        convenient_upload_handler.handle_raw_input(None, None, self.test_file_size, None, writer_settings, None)
+        try:
+            convenient_upload_handler.new_file(None, "kitten.jpg", None, None, None)
+        except StopFutureHandlers:
+            pass
+        for start in range(0, len(content), self.chunk_size):
+            convenient_upload_handler.receive_data_chunk(content[start:start + self.chunk_size], start)
+        on_disk_file = convenient_upload_handler.file_complete(len(content))
+        self.assertEquals(content, on_disk_file.read())
+        on_disk_file.close()
+        convenient_upload_handler.handle_raw_input(None, None, self.test_file_size, None, custom_settings, None)
+
+        #a small file afterwards is held in memory
+        try:
+            convenient_upload_handler.new_file(None, "small.txt", None, None, None)
+        except StopFutureHandlers:
+            pass
+        convenient_upload_handler.receive_data_chunk(b"small", 0)
+        in_memory_file = convenient_upload_handler.file_complete(5)
+
+        self.assertTrue(isinstance(in_memory_file, InMemoryUploadedFile))
+        self.assertEquals(b"small", in_memory_file.read())
+
+    def test_convenient_file_upload_declared_size(self):
+        """
+        Test ConvenientFileUploadHandler goes straight to disk for a file
+        declaring a size over FILE_UPLOAD_MAX_MEMORY_SIZE.
+        """
+        #set max in memory to 500KB
+        max_in_memory_size = 500 * (2 ** 10)
+        custom_settings = Settings({Settings.Key.FILE_UPLOAD_MAX_MEMORY : max_in_memory_size}, check_presence=True)
+
+        convenient_upload_handler = uploadhandler.load_handler(self.FILE_UPLOAD_HANDLERS[2])
+        convenient_upload_handler.handle_raw_input(None, None, self.test_file_size, None, custom_settings, None)
+
+        with self.assertRaises(StopFutureHandlers):
+            convenient_upload_handler.new_file(None, "kitten.jpg", None, 572562, None)
+        self.assertTrue(convenient_upload_handler._switched_to_temp_file)
+
+        convenient_upload_handler.receive_data_chunk(b"kitten", 0)
+        on_disk_file = convenient_upload_handler.file_complete(6)
+
+        self.assertTrue(isinstance(on_disk_file, TemporaryUploadedFile))
+        self.assertEquals(b"kitten", on_disk_file.read())
+        on_disk_file.close()
+
+
+    def test_memory_budget(self):
+        """
+        Test uploads spill to disk once the process-wide memory budget is
+        exhausted and give the memory back when they are closed.
+        """
+        #a 100KB budget and 1MB max in memory
+        custom_settings = Settings({
+            Settings.Key.FILE_UPLOAD_MAX_MEMORY : 1 * (2 ** 10) * (2 ** 10),
+            Settings.Key.FILE_UPLOAD_MEMORY_BUDGET : 100 * (2 ** 10) + 1
+        }, check_presence=True)
+        budget = get_memory_budget(custom_settings)
+        self.assertIs(budget, get_memory_budget(custom_settings))
+
+        with open(self.test_file_path, "rb") as test_file:
+            content = test_file.read()
+
+        #the post doesn't fit in the budget, the memory handler declines it
+        in_memory_upload_handler = uploadhandler.load_handler(self.FILE_UPLOAD_HANDLERS[0])
+        in_memory_upload_handler.handle_raw_input(None, None, len(content), None, custom_settings, None)
+        self.assertFalse(in_memory_upload_handler.activated)
+        self.assertEqual(0, budget.current)
+
+        convenient_upload_handler = uploadhandler.load_handler(self.FILE_UPLOAD_HANDLERS[2])
+        convenient_upload_handler.handle_raw_input(None, None, len(content), None, custom_settings, None)
+
+        #a small file is held in memory until it's closed
+        try:
+            convenient_upload_handler.new_file(None, "small.txt", None, None, None)
+        except StopFutureHandlers:
+            pass
+        convenient_upload_handler.receive_data_chunk(b"small", 0)
+        in_memory_file = convenient_upload_handler.file_complete(5)
+        self.assertTrue(isinstance(in_memory_file, InMemoryUploadedFile))
+        self.assertEqual(5, budget.current)
+
+        #the large one spills to disk when the budget is exhausted
+        try:
+            convenient_upload_handler.new_file(None, "kitten.jpg", None, None, None)
+        except StopFutureHandlers:
+            pass
+        for start in range(0, len(content), self.chunk_size):
+            convenient_upload_handler.receive_data_chunk(content[start:start + self.chunk_size], start)
+        on_disk_file = convenient_upload_handler.file_complete(len(content))
+        convenient_upload_handler.upload_complete()
+
+        self.assertTrue(isinstance(on_disk_file, TemporaryUploadedFile))
+        self.assertEqual(content, on_disk_file.read())
+        on_disk_file.close()
+        self.assertEqual(5, budget.current)
+        self.assertEqual(5 + self.chunk_size, budget.peak)
+
+        in_memory_file.close()
+        self.assertEqual(0, budget.current)
+
+        #a file that's never closed gives the memory back once it's dropped
+        try:
+            convenient_upload_handler.new_file(None, "small.txt", None, None, None)
+        except StopFutureHandlers:
+            pass
+        convenient_upload_handler.receive_data_chunk(b"small", 0)
+        in_memory_file = convenient_upload_handler.file_complete(5)
+        convenient_upload_handler.upload_complete()
+        self.assertEqual(5, budget.current)
+        del in_memory_file
+        gc.collect()
+        self.assertEqual(0, budget.current)
+
+
+    def test_destination_file_upload(self):
+        """
+        Test DestinationFileUploadHandler writes files in place and removes
+        the ones that aren't complete.
+        """
+        destination_dir = tempfile.mkdtemp()
+        try:
+            custom_settings = Settings({
+                Settings.Key.FILE_UPLOAD_DESTINATION_DIR : destination_dir,
+                Settings.Key.FILE_UPLOAD_DESTINATION_NAME : lambda field_name, file_name, content_type: field_name + ".jpg"
+            })
+
+            with open(self.test_file_path, "rb") as test_file:
+                content = test_file.read()
+
+            destination_upload_handler = uploadhandler.load_handler('request_parser.files.uploadhandler.DestinationFileUploadHandler')
+            destination_upload_handler.handle_raw_input(None, None, len(content), None, custom_settings, None)
+
+            with self.assertRaises(StopFutureHandlers):
+                destination_upload_handler.new_file("kitten", "kitten.jpg", "image/jpeg", None)
+            for start in range(0, len(content), self.chunk_size):
+                destination_upload_handler.receive_data_chunk(content[start:start + self.chunk_size], start)
+            uploaded_file = destination_upload_handler.file_complete(len(content))
+
+            self.assertTrue(isinstance(uploaded_file, DestinationUploadedFile))
+            self.assertEqual(join(destination_dir, "kitten.jpg"), uploaded_file.file_path())
+            self.assertEqual(["kitten.jpg"], listdir(destination_dir))
+            self.assertEqual(content, uploaded_file.read())
+
+            #a complete file is never replaced, the colliding one is removed
+            with self.assertRaises(StopFutureHandlers):
+                destination_upload_handler.new_file("kitten", "kitten.jpg", "image/jpeg", None)
+            destination_upload_handler.receive_data_chunk(b"kitten", 0)
+            with self.assertRaises(MultiPartParserError):
+                destination_upload_handler.file_complete(6)
+            self.assertEqual(["kitten.jpg"], listdir(destination_dir))
+            with open(join(destination_dir, "kitten.jpg"), "rb") as destination_file:
+                self.assertEqual(content, destination_file.read())
+
+            #a skipped file is removed when it's closed
+            with self.assertRaises(StopFutureHandlers):
+                destination_upload_handler.new_file("skipped", "skipped.jpg", "image/jpeg", None)
+            destination_upload_handler.receive_data_chunk(b"skipped", 0)
+            destination_upload_handler.file.close()
+            self.assertEqual(["kitten.jpg"], listdir(destination_dir))
+
+            #move_to() renames the file
+            moved_path = join(destination_dir, "moved.jpg")
+            self.assertEqual(moved_path, uploaded_file.move_to(moved_path))
+            self.assertEqual(["moved.jpg"], listdir(destination_dir))
+            self.assertEqual(content, uploaded_file.read())
+            uploaded_file.close()
+            self.assertTrue(exists(moved_path))
+        finally:
+            shutil.rmtree(destination_dir)
+
+    def test_move_to(self):
+        """
+        Test move_to() of temporary and in-memory uploaded files.
+        """
+        destination_dir = tempfile.mkdtemp()
+        try:
+            temp_upload_file = TemporaryUploadedFile("kitten.jpg", "image/jpeg", 0, None, Settings.default(check_presence=True))
+            temp_upload_file.write(b"kitten")
+            temp_path = temp_upload_file.temporary_file_path()
+
+            moved_path = join(destination_dir, "kitten.jpg")
+            temp_upload_file.move_to(moved_path)
+            self.assertFalse(exists(temp_path))
+            self.assertEqual(moved_path, temp_upload_file.temporary_file_path())
+            self.assertEqual(b"kitten", temp_upload_file.read())
+            temp_upload_file.close()
+
+            in_memory_file = SimpleUploadedFile("small.txt", b"small")
+            with self.assertRaises(OSError):
+                in_memory_file.move_to(moved_path)
+            in_memory_file.move_to(moved_path, allow_overwrite=True)
+            with open(moved_path, "rb") as moved_file:
+                self.assertEqual(b"small", moved_file.read())
+        finally:
+            shutil.rmtree(destination_dir)
+
+
+    def test_upload_temporary_file(self):
+        """
+        Test the temp files uploads are streamed into, pooled or not, take
+        their suffix and are removed on close.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            pool = temp.TemporaryFilePool(temp_dir, 2)
+            #the first get() starts filling the pool
+            pool.get()
+            for i in range(500):
+                if pool._files.full():
+                    break
+                time.sleep(0.01)
+            #the files are created in the directory ahead of time
+            self.assertTrue(len(listdir(temp_dir)) >= 2)
+
+            for temp_file in (pool.get('.upload.jpg'), temp.upload_temporary_file(suffix='.upload.jpg', dir=temp_dir)):
+                temp_file.write(b"kitten")
+                temp_file.flush()
+
+                temp_path = temp_file.name
+                self.assertTrue(temp_path.endswith('.upload.jpg'))
+                with open(temp_path, "rb") as named_file:
+                    self.assertEqual(b"kitten", named_file.read())
+                temp_file.close()
+                self.assertFalse(exists(temp_path))
+            pool.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+    def test_temp_file_upload_coalesced_writes(self):
+        """
+        Test TemporaryFileUploadHandler gathers small chunks before writing
+        them.
+        """
+        custom_settings = Settings({Settings.Key.FILE_UPLOAD_WRITE_BUFFER_SIZE : 4096}, check_presence=True)
+
+        with open(self.test_file_path, "rb") as test_file:
+            content = test_file.read()
+
+        writes = []
+        real_write_chunks = uploadhandler.write_chunks
+        def write_chunks(file, chunks):
+            writes.append(sum(len(chunk) for chunk in chunks))
+            real_write_chunks(file, chunks)
+        uploadhandler.write_chunks = write_chunks
+        try:
+            temp_file_upload_handler = uploadhandler.load_handler(self.FILE_UPLOAD_HANDLERS[1])
+            temp_file_upload_handler.handle_raw_input(None, None, len(content), None, custom_settings, None)
+            temp_file_upload_handler.new_file(None, "kitten.jpg", None, len(content))
+            for start in range(0, len(content), 1000):
+                temp_file_upload_handler.receive_data_chunk(content[start:start + 1000], start)
+            temp_upload_file = temp_file_upload_handler.file_complete(len(content))
+        finally:
+            uploadhandler.write_chunks = real_write_chunks
+
+        #a write per 4096 bytes, not per chunk
+        self.assertTrue(len(writes) < (len(content) + 999) // 1000)
+        self.assertEqual(len(content), sum(writes))
+        self.assertEqual(content, temp_upload_file.read())
+        self.assertEqual(len(content), getsize(temp_upload_file.temporary_file_path()))
+        temp_upload_file.close()
+
+
+    def test_temp_file_upload_writer_threads(self):
+        """
+        Test TemporaryFileUploadHandler writes files in order from writer
+        threads and waits for them on file_complete.
+        """
+        custom_settings = Settings({
+            Settings.Key.FILE_UPLOAD_WRITE_BUFFER_SIZE : 0,
+            Settings.Key.FILE_UPLOAD_WRITER_THREADS : 2,
+            Settings.Key.FILE_UPLOAD_WRITER_QUEUE_SIZE : 2
+        }, check_presence=True)
+
+        with open(self.test_file_path, "rb") as test_file:
+            content = test_file.read()
+
+        temp_file_upload_handler = uploadhandler.load_handler(self.FILE_UPLOAD_HANDLERS[1])
+        temp_file_upload_handler.handle_raw_input(None, None, len(content), None, custom_settings, None)
+        temp_upload_files = []
+        for file_name in ("kitten.jpg", "kitten2.jpg"):
+            temp_file_upload_handler.new_file(None, file_name, None, None)
+            for start in range(0, len(content), 1000):
+                temp_file_upload_handler.receive_data_chunk(content[start:start + 1000], start)
+            temp_upload_files.append(temp_file_upload_handler.file_complete(len(content)))
+
+        for temp_upload_file in temp_upload_files:
+            self.assertEqual(content, temp_upload_file.read())
+            temp_upload_file.close()
+
+
+    def test_temp_file_upload_interrupted_writes(self):
+        """
+        Test the writes still queued for a file are dropped, and the one being
+        done waited for, before the file is closed when the upload is
+        interrupted, and that a failed write is raised by file_complete.
+        """
+        custom_settings = Settings({
+            Settings.Key.FILE_UPLOAD_WRITE_BUFFER_SIZE : 0,
+            Settings.Key.FILE_UPLOAD_WRITER_THREADS : 1,
+            Settings.Key.FILE_UPLOAD_WRITER_QUEUE_SIZE : 8,
+            #the file is handed over in chunk_size chunks
+            Settings.Key.MULTIPART_ENGINE : 'stream',
+            Settings.Key.MULTIPART_BUFFER_MAX_SIZE : None
+        }, check_presence=True)
+
+        content = b"0123456789" * 20
+        boundary = '----WebKitFormBoundaryOmz20xyMCkE27rN7'
+        body = b'--' + boundary.encode() + b'\r\n'
+        body += b'Content-Disposition: form-data; name="upload"; filename="upload.txt"\r\n\r\n'
+        body += content + b'\r\n'
+        body += b'--' + boundary.encode() + b'--\r\n'
+        META = {
+            'Content-Type' : 'multipart/form-data; boundary=' + boundary,
+            'Content-Length' : str(len(body))
+        }
+
+        unblock = threading.Event()
+        received = []
+        class InterruptingHandler(FileUploadHandler):
+            chunk_size = 10
+            def receive_data_chunk(self, raw_data, start):
+                received.append(raw_data)
+                if len(received) == 5:
+                    #the first write goes on once the parser waits for it
+                    threading.Timer(0.1, unblock.set).start()
+                    raise ValueError("interrupted")
+                return raw_data
+            def file_complete(self, file_size):
+                return None
+
+        written = []
+        real_write_chunks = uploadhandler.write_chunks
+        def write_chunks(file, chunks):
+            unblock.wait()
+            self.assertFalse(file.closed)
+            written.append(b"".join(chunks))
+            real_write_chunks(file, chunks)
+        uploadhandler.write_chunks = write_chunks
+        try:
+            temp_file_upload_handler = uploadhandler.load_handler(self.FILE_UPLOAD_HANDLERS[1])
+            parser = MultiPartParser(META, BytesIO(body), [InterruptingHandler(), temp_file_upload_handler], custom_settings)
+            with self.assertRaises(ValueError):
+                parser.parse()
+        finally:
+            unblock.set()
+            uploadhandler.write_chunks = real_write_chunks
+
+        #the first write was done before the file was closed, the queued ones dropped
+        self.assertEqual(received[:1], written)
+        self.assertTrue(temp_file_upload_handler.file.closed)
+
+        def failing_write_chunks(file, chunks):
+            raise IOError("disk full")
+        uploadhandler.write_chunks = failing_write_chunks
+        try:
+            temp_file_upload_handler.reset()
+            temp_file_upload_handler.handle_raw_input(None, None, len(content), None, custom_settings, None)
+            temp_file_upload_handler.new_file(None, "upload.txt", None, None)
+        finally:
+            uploadhandler.write_chunks = real_write_chunks
+        temp_file_upload_handler.receive_data_chunk(content, 0)
+        with self.assertRaises(IOError):
+            temp_file_upload_handler.file_complete(len(content))
+        temp_file_upload_handler.free_file()
+
+
+    def test_handler_registry(self):
+        """
+        Test the handler classes are imported once and reusable handlers are
+        handed out again, reset, once released.
+        """
+        settings = Settings.default()
+        registry = uploadhandler.get_handler_registry(settings)
+        self.assertIs(registry, uploadhandler.get_handler_registry(settings.overlay()))
+        self.assertEqual((uploadhandler.ConvenientFileUploadHandler,), registry.classes)
+
+        request = request_parser.http.request.HttpRequest()
+        request_ref = weakref.ref(request)
+        handlers = registry.handlers(request)
+        convenient_upload_handler = handlers[0]
+        convenient_upload_handler.handle_raw_input(None, None, 0, None, settings, None)
+        try:
+            convenient_upload_handler.new_file(None, "small.txt", None, None, None)
+        except StopFutureHandlers:
+            pass
+        convenient_upload_handler.receive_data_chunk(b"small", 0)
+        registry.release(handlers)
+
+        #an idle handler doesn't keep the request or its file alive
+        del request
+        gc.collect()
+        self.assertIsNone(request_ref())
+        self.assertIsNone(convenient_upload_handler.request)
+        self.assertFalse(hasattr(convenient_upload_handler._memory_handler, 'file'))
+
+        #the released handler is reset for the next request
+        self.assertEqual([convenient_upload_handler], registry.handlers("request 2"))
+        self.assertEqual("request 2", convenient_upload_handler.request)
+        self.assertIsNone(convenient_upload_handler.file_name)
+        self.assertEqual(0, convenient_upload_handler._received_data_size)
+        self.assertFalse(hasattr(convenient_upload_handler._memory_handler, 'file'))
+
+
+    def test_compressing_file_upload(self):
+        """
+        Test CompressingFileUploadHandler stores files compressed per content
+        type and the files it returns read back the original content.
+        """
+        content = b"".join(b"%d,kitten.jpg,572562\r\n" % (i % 100) for i in range(20000))
+
+        for codec in sorted(CODECS):
+            custom_settings = Settings({
+                Settings.Key.FILE_UPLOAD_COMPRESSION : {'text/*' : codec}
+            }, check_presence=True)
+
+            compressing_upload_handler = uploadhandler.load_handler('request_parser.files.uploadhandler.CompressingFileUploadHandler')
+            compressing_upload_handler.handle_raw_input(None, None, len(content), None, custom_settings, None)
+            compressing_upload_handler.new_file(None, "kittens.csv", "text/csv", len(content))
+            for start in range(0, len(content), self.chunk_size):
+                compressing_upload_handler.receive_data_chunk(content[start:start + self.chunk_size], start)
+            compressed_file = compressing_upload_handler.file_complete(len(content))
+
+            self.assertTrue(isinstance(compressed_file, CompressedUploadedFile))
+            self.assertEqual(len(content), compressed_file.size)
+            self.assertTrue(compressed_file.stored_size < len(content) / 5)
+            self.assertEqual(compressed_file.stored_size, getsize(compressed_file.temporary_file_path()))
+            self.assertEqual(content, compressed_file.read())
+            self.assertEqual(content, b"".join(compressed_file.chunks(1000)))
+
+            #tell() is the position in the original content
+            compressed_file.seek(0)
+            self.assertEqual(content[:1000], compressed_file.read(1000))
+            self.assertEqual(1000, compressed_file.tell())
+            self.assertEqual(content[1000:], compressed_file.read())
+            self.assertEqual(len(content), compressed_file.tell())
+
+            #moving stores the original content unless asked otherwise
+            destination_dir = tempfile.mkdtemp()
+            try:
+                moved_path = compressed_file.move_to(join(destination_dir, "kittens.csv"))
+                with open(moved_path, "rb") as moved_file:
+                    self.assertEqual(content, moved_file.read())
+                moved_path = compressed_file.move_to(join(destination_dir, "kittens.csv." + codec), compressed=True)
+                self.assertEqual(compressed_file.stored_size, getsize(moved_path))
+                self.assertEqual(content, compressed_file.read())
+
+                #open() starts over, reopening a closed file where it was moved
+                self.assertEqual(content[:1000], compressed_file.open().read(1000))
+                compressed_file.file.close()
+                self.assertEqual(content, compressed_file.open().read())
+                self.assertEqual(len(content), compressed_file.tell())
+            finally:
+                compressed_file.close()
+                shutil.rmtree(destination_dir)
+
+        #other content types are stored as is
+        compressing_upload_handler.new_file(None, "kitten.jpg", "image/jpeg", None)
+        compressing_upload_handler.receive_data_chunk(b"kitten", 0)
+        temp_upload_file = compressing_upload_handler.file_complete(6)
+        self.assertFalse(isinstance(temp_upload_file, CompressedUploadedFile))
+        self.assertEqual(b"kitten", temp_upload_file.read())
+        temp_upload_file.close()
+
 unittest.main()
\ No newline at end of file
@@ -423,6 +423,36 @@ class LazyStream:
     def __iter__(self):
         return self
 
+    def skip(self, size=None):
+        """
+        Discard size bytes of the stream (all of it if size is None) and
+        return the number of bytes discarded.
+
+        Cheaper than read(): nothing is accumulated and a file-like producer
+        is skipped with skip_file().
+        """
+        leftover = self._leftover if size is None else self._leftover[:size]
+        self._leftover = self._leftover[len(leftover):]
+        skipped = len(leftover)
+
+        remaining = None if size is None else size - skipped
+        if remaining != 0:
+            producer = self._producer
+            if hasattr(producer, 'skip') or hasattr(producer, 'read'):
+                skipped += skip_file(producer, remaining)
+            else:
+                for chunk in producer:
+                    if remaining is not None and len(chunk) >= remaining:
+                        self._leftover = chunk[remaining:]
+                        skipped += remaining
+                        break
+                    skipped += len(chunk)
+                    if remaining is not None:
+                        remaining -= len(chunk)
+
+        self.position += skipped
+        return skipped
+
     def unget(self, bytes):
         """
         Place bytes back onto the front of the lazy stream.
@@ -479,3 +509,72 @@ class ChunkIter:
 
     def __iter__(self):
         return self
+
+    def skip(self, size=None):
+        """
+        Discard size bytes of the underlying file-like object (all of it if
+        size is None) and return the number of bytes discarded.
+        """
+        return skip_file(self.flo, size)
+
+#discarded bytes are read into this buffer, what it holds is never looked at
+#so it is shared by all the skip_file() calls
+_discard_buffer = bytearray(256 * 1024)
+
+def _is_seekable(flo):
+    """
+    Return whether the file-like object flo supports seek() and tell().
+    """
+    if not hasattr(flo, 'seek'):
+        return False
+    seekable = getattr(flo, 'seekable', None)
+    if seekable is not None:
+        try:
+            return seekable()
+        except (IOError, OSError, ValueError):
+            return False
+    #Python 2 file objects have no seekable(), tell() fails on pipes
+    try:
+        flo.tell()
+    except (AttributeError, IOError, OSError):
+        return False
+    return True
+
+def skip_file(flo, size=None):
+    """
+    Discard size bytes of the file-like object flo (up to its end if size
+    is None) and return the number of bytes discarded.
+
+    Seekable objects (regular files, BytesIO) are skipped with a single
+    seek, others (sockets, pipes) with large reads into a reused buffer.
+    """
+    skip = getattr(flo, 'skip', None)
+    if skip is not None:
+        return skip(size)
+
+    if _is_seekable(flo):
+        start = flo.tell()
+        flo.seek(0, 2)
+        end = flo.tell()
+        if size is not None and start + size < end:
+            end = start + size
+        flo.seek(end)
+        return end - start
+
+    skipped = 0
+    readinto = getattr(flo, 'readinto', None)
+    buffer = memoryview(_discard_buffer)
+    try:
+        while size is None or skipped < size:
+            if size is not None and size - skipped < len(buffer):
+                buffer = buffer[:size - skipped]
+            if readinto is not None:
+                count = readinto(buffer)
+            else:
+                count = len(flo.read(len(buffer)))
+            if not count:
+                break
+            skipped += count
+    except InputStreamExhausted:
+        pass
+    return skipped